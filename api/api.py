@@ -3,6 +3,7 @@ from ninja.operation import Operation
 
 from authenticator.api import JWTAuthBearer
 from authenticator.api import router as authenticator_router
+from authenticator.middleware import instrument_api
 from oauth2.api import router as oauth_router
 from share.api import router as share_router
 
@@ -18,3 +19,5 @@ api = SharedTWApi(title="shared-tw API", version="0.1.0")
 api.add_router("auth", authenticator_router)
 api.add_router("oauth", oauth_router)
 api.add_router("", share_router, auth=JWTAuthBearer())
+
+instrument_api(api)
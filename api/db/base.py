@@ -0,0 +1,170 @@
+"""PostgreSQL backend with connection health checks and prepared statements
+
+Set "ENGINE": "api.db" and the extra keys of the database settings:
+
+- CONN_HEALTH_CHECKS: check a persistent connection before its first use in
+  a request and reconnect if it is broken, like Django 4.1.
+- PREPARE_THRESHOLD: prepare a SELECT on the server once it has been run that
+  many times on the connection, and execute the prepared statement after that
+  so that it is not parsed and planned again. None disables it.
+"""
+import functools
+import re
+from collections import OrderedDict
+
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+# The %s placeholders and the escaped %% of the SQL of Django
+PLACEHOLDER_RE = re.compile(r"%([s%])")
+# The statements which are counted or prepared per connection
+MAX_STATEMENTS = 256
+
+
+def to_server_placeholders(sql: str) -> str:
+    counter = 0
+
+    def replace(match):
+        nonlocal counter
+        if match.group(1) == "%":
+            return "%"
+        counter += 1
+        return f"${counter}"
+
+    return PLACEHOLDER_RE.sub(replace, sql)
+
+
+class PreparedStatements:
+    """The prepared statements of a connection, see `PREPARE_THRESHOLD`"""
+
+    def __init__(self, connection, threshold: int):
+        self.connection = connection
+        self.threshold = threshold
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self._names: "OrderedDict[str, str]" = OrderedDict()
+        self._unpreparable = set()
+        self._next_id = 0
+
+    def rewrite(self, cursor, sql: str, params):
+        """Return the SQL and the parameters to execute on the `cursor`"""
+        if (
+            cursor.name  # DECLARE CURSOR of .iterator()
+            or isinstance(params, dict)
+            or sql in self._unpreparable
+            or sql.lstrip()[:6].upper() != "SELECT"
+        ):
+            return sql, params
+
+        name = self._names.get(sql)
+        if name is None:
+            count = self._counts.pop(sql, 0) + 1
+            if count < self.threshold:
+                self._counts[sql] = count
+                if len(self._counts) > MAX_STATEMENTS:
+                    self._counts.popitem(last=False)
+                return sql, params
+            name = self._prepare(cursor, sql)
+            if name is None:
+                return sql, params
+        else:
+            self._names.move_to_end(sql)
+
+        if not params:
+            return f"EXECUTE {name}", None
+        return f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params
+
+    def _prepare(self, cursor, sql: str):
+        self._next_id += 1
+        name = f"django_{self._next_id}"
+
+        # A failure must not abort the transaction the query runs in
+        in_transaction = self.connection.in_atomic_block
+        if in_transaction:
+            cursor.execute(f"SAVEPOINT {name}")
+        try:
+            cursor.execute(f"PREPARE {name} AS {to_server_placeholders(sql)}")
+        except self.connection.Database.Error:
+            if in_transaction:
+                cursor.execute(f"ROLLBACK TO SAVEPOINT {name}")
+            # e.g. the type of a parameter can't be inferred
+            self._unpreparable.add(sql)
+            return None
+        if in_transaction:
+            cursor.execute(f"RELEASE SAVEPOINT {name}")
+
+        self._names[sql] = name
+        if len(self._names) > MAX_STATEMENTS:
+            _, evicted = self._names.popitem(last=False)
+            cursor.execute(f"DEALLOCATE {evicted}")
+        return name
+
+
+class PreparingCursor(extensions.cursor):
+    """The psycopg2 cursor which executes the prepared statements
+
+    The statements are rewritten below the cursor wrappers of Django, so the
+    execute wrappers, `connection.queries` and the query logs see the original
+    SQL: `query` is the original one with its parameters.
+    """
+
+    def __init__(self, db, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.db = db
+        self._original = None
+
+    def execute(self, sql, params=None):
+        self._original = None
+        prepared_statements = self.db.prepared_statements
+        if prepared_statements is not None:
+            executed_sql, executed_params = prepared_statements.rewrite(
+                self, sql, params
+            )
+            if executed_sql is not sql:
+                self._original = (sql, params)
+                sql, params = executed_sql, executed_params
+        return super().execute(sql, params)
+
+    @property
+    def query(self):
+        if self._original is not None:
+            return self.mogrify(*self._original)
+        return super().query
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, settings_dict, *args, **kwargs):
+        super().__init__(settings_dict, *args, **kwargs)
+        self.health_check_enabled = settings_dict.get("CONN_HEALTH_CHECKS", False)
+        self.health_check_done = False
+        self.prepare_threshold = settings_dict.get("PREPARE_THRESHOLD")
+        self.prepared_statements = None
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        connection.cursor_factory = functools.partial(PreparingCursor, self)
+        self.health_check_done = True
+        # The prepared statements belong to the server session
+        self.prepared_statements = None
+        if self.prepare_threshold is not None:
+            self.prepared_statements = PreparedStatements(self, self.prepare_threshold)
+        return connection
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        # Called on the start and the end of the requests
+        self.health_check_done = False
+
+    def close_if_health_check_failed(self):
+        if (
+            self.connection is None
+            or not self.health_check_enabled
+            or self.health_check_done
+        ):
+            return
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
@@ -0,0 +1,139 @@
+"""Prometheus metrics, served on /metrics
+
+The workers of gunicorn share the metrics through the files of the directory
+in PROMETHEUS_MULTIPROC_DIR, see gunicorn.conf.py. Without it, e.g. under
+runserver, the metrics are of the current process. The email queue and the
+database connections are read from the database on each scrape, so they are
+the same whichever worker serves it.
+"""
+import hmac
+import os
+import time
+import typing
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+REQUEST_DURATION = Histogram(
+    "sharedtw_request_duration_seconds",
+    "Latency of the requests of each API operation",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DONATION_TRANSITIONS = Counter(
+    "sharedtw_donation_transitions_total",
+    "Committed state transitions of the donations, see Donation.set_events",
+    ["event", "state"],
+)
+CACHE_REQUESTS = Counter(
+    "sharedtw_cache_requests_total",
+    "Lookups of the caches, the hit ratio is hit / (hit + miss)",
+    ["cache", "result"],
+)
+
+
+def count_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def count_transitions(transitions: typing.Dict[typing.Tuple[str, str], int]):
+    """Count the {(event, new state): count} of the donations"""
+    for (event, state), count in transitions.items():
+        DONATION_TRANSITIONS.labels(event, state).inc(count)
+
+
+class DatabaseCollector:
+    """Gauges of the outgoing emails and the database connections"""
+
+    def describe(self):
+        # Not collected on the registration, the database might not be ready
+        return []
+
+    def collect(self):
+        from django.db import connection
+
+        from authenticator import models
+
+        queue = GaugeMetricFamily(
+            "sharedtw_email_queue_depth",
+            "Emails waiting to be sent, including the ones waiting for a retry",
+        )
+        queue.add_metric(
+            [],
+            models.OutgoingEmail.objects.filter(
+                sent_at__isnull=True,
+                attempts__lt=settings.AUTHENTICATOR["email_max_attempts"],
+            ).count(),
+        )
+        yield queue
+
+        # Every process holds its own persistent connections, the server sees
+        # all of them.
+        connections = GaugeMetricFamily(
+            "sharedtw_db_connections",
+            "Connections to the database by state",
+            labels=["state"],
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT coalesce(state, 'unknown'), count(*) FROM pg_stat_activity "
+                "WHERE datname = current_database() GROUP BY 1"
+            )
+            for state, count in cursor.fetchall():
+                connections.add_metric([state], count)
+            cursor.execute("SHOW max_connections")
+            max_connections = int(cursor.fetchone()[0])
+        yield connections
+        yield GaugeMetricFamily(
+            "sharedtw_db_max_connections",
+            "max_connections of the database server",
+            value=max_connections,
+        )
+
+
+database_collector = DatabaseCollector()
+REGISTRY.register(database_collector)
+
+
+def view(request):
+    token = settings.METRICS_TOKEN
+    if token and not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return HttpResponse(status=401)
+
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(database_collector)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """Observe the latency of the requests, it should be the first one"""
+
+    def process_request(self, request):
+        request._metrics_started_at = time.perf_counter()
+
+    def process_response(self, request, response):
+        started_at = getattr(request, "_metrics_started_at", None)
+        if started_at is not None:
+            match = request.resolver_match
+            # The unmatched paths are not labels, they are endless
+            route = f"/{match.route}" if match else "unmatched"
+            REQUEST_DURATION.labels(
+                request.method, route, response.status_code
+            ).observe(time.perf_counter() - started_at)
+        return response
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 import logging.config
 import os
+from datetime import timedelta
 from pathlib import Path
 
 from django.utils.log import DEFAULT_LOGGING
@@ -45,11 +46,13 @@ INSTALLED_APPS = [
     # 3rd party
     "corsheaders",
     # shared tw
+    "authenticator",
     "share",
     "oauth2",
 ]
 
 MIDDLEWARE = [
+    "api.metrics.MetricsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -59,6 +62,7 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "authenticator.middleware.Status403Middleware",
+    "authenticator.middleware.ServerTimingMiddleware",
 ]
 
 ROOT_URLCONF = "api.urls"
@@ -85,18 +89,48 @@ WSGI_APPLICATION = "api.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# DB_POOL=1 keeps the connections open with health checks and prepares the
+# repeated queries, see api.db
+DB_POOL = os.getenv("DB_POOL", "0") == "1"
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql_psycopg2",
+        "ENGINE": "api.db",
         "NAME": "sharedtw",
         "USER": os.environ.get("DB_USER", "postgres"),
         "PASSWORD": os.environ.get("DB_PASSWORD", "password"),
         "HOST": os.environ.get("DB_HOST", "localhost"),
         "PORT": os.environ.get("DB_POST", "5432"),
+        "CONN_MAX_AGE": 600 if DB_POOL else 0,
+        "CONN_HEALTH_CHECKS": DB_POOL,
+        "PREPARE_THRESHOLD": 5 if DB_POOL else None,
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+# Comma separated memcached servers, e.g. "127.0.0.1:11211". The cached
+# responses and the rate limits are per process without them.
+MEMCACHED_LOCATION = os.getenv("MEMCACHED_LOCATION", "")
+
+if MEMCACHED_LOCATION:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache",
+            "LOCATION": MEMCACHED_LOCATION.split(","),
+            "OPTIONS": {"connect_timeout": 1, "timeout": 1, "no_delay": True},
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -172,12 +206,22 @@ logging.config.dictConfig(
                 "handlers": ["console"],
                 "propagate": False,
             },
+            # The timings of the requests
+            "authenticator.middleware": {
+                "level": LOGLEVEL,
+                "handlers": ["console"],
+                "propagate": False,
+            },
             # Default runserver request logging
             "django.server": DEFAULT_LOGGING["loggers"]["django.server"],
         },
     }
 )
 
+# Bearer token of /metrics, see api.metrics. Empty allows any scraper, which
+# api.settings_prod refuses.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 # Email settings
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 EMAIL_HOST = "smtp.gmail.com"
@@ -196,6 +240,14 @@ CORS_ALLOW_ALL_ORIGINS = True
 SHARED_TW_SETTINGS = {
     "line_client_id": os.environ.get("LINE_CLIENT_ID"),
     "line_client_secret": os.environ.get("LINE_CLIENT_SECRET"),
+    "line_access_url": os.getenv("LINE_ACCESS_URL", "https://access.line.me"),
+    "line_api_url": os.getenv("LINE_API_URL", "https://api.line.me"),
+    # The LINE API calls of the callback, see oauth2.line
+    "line_connect_timeout": 3,
+    "line_read_timeout": 5,
+    "line_max_connections": 20,
+    "line_breaker_threshold": 5,
+    "line_breaker_reset_timeout": 30,
     # "domain": os.getenv("DOMAIN", "shared-tw.icu"),
 }
 
@@ -204,7 +256,39 @@ AUTHENTICATOR = {
     # Do not use SECRET_KEY to prevent the key gets leak
     "hash_id_secret": os.getenv("HASH_ID_SECRET", "__not_set__"),
     "min_length": int(os.getenv("MIN_LENGTH", "7")),
+    # The memoized ids, see authenticator.utils.encode_id
+    "hash_id_cache_size": 4096,
     "verification_email_url": "/auth/verify-email?uid={uid}&token={token}",
+    # Per-process cache of the authenticated users, see authenticator.principals
+    "principal_cache_size": int(os.getenv("PRINCIPAL_CACHE_SIZE", "1024")),
+    "principal_cache_ttl": float(os.getenv("PRINCIPAL_CACHE_TTL", "30")),
+    "profile_related_names": ("organization", "donator"),
+    # Buffer last_login and write it in bulk, see authenticator.last_login.
+    # Disable it if last_login must be accurate at all times.
+    "last_login_write_behind": os.getenv("LAST_LOGIN_WRITE_BEHIND", "1") == "1",
+    "last_login_flush_interval": float(os.getenv("LAST_LOGIN_FLUSH_INTERVAL", "30")),
+    # Outbox of the emails, see authenticator.outbox
+    "email_batch_size": 50,
+    "email_max_attempts": 5,
+    "email_retry_backoff": 30,  # seconds, doubled after each attempt
+    "email_max_retry_delay": 60 * 60,
+    "email_claim_timeout": 10 * 60,  # seconds, a claimed batch is retried after
+    # Password hashing off the request threads, see authenticator.hashing
+    "password_hashing_workers": int(os.getenv("PASSWORD_HASHING_WORKERS", "2")),
+    "password_hashing_max_pending": int(os.getenv("PASSWORD_HASHING_MAX_PENDING", "8")),
+    "password_hashing_timeout": 5,
+    # (limit, window in seconds) of POST /auth/token, see authenticator.ratelimit
+    "login_rate_limits": {"username": (10, 60), "ip": (30, 60)},
+    # The number of the proxies which append X-Forwarded-For
+    "num_proxies": 0,
+    # Revoked refresh tokens, see authenticator.denylist
+    "refresh_token_expires": timedelta(days=7),
+    "denylist_refresh_interval": float(os.getenv("DENYLIST_REFRESH_INTERVAL", "5")),
+    # Server-Timing header of the requests, their log lines are DEBUG but for
+    # the slow ones, see authenticator.middleware.ServerTimingMiddleware
+    "server_timing": os.getenv("SERVER_TIMING", "1") == "1",
+    "slow_request_ms": float(os.getenv("SLOW_REQUEST_MS", "500")),
+    "slow_request_queries": int(os.getenv("SLOW_REQUEST_QUERIES", "20")),
 }
 
 
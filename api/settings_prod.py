@@ -1,16 +1,31 @@
 import os
 
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 
 from .settings import *  # noqa: F403
 
 DEBUG = False
 SECRET_KEY = os.environ["SECRET_KEY"]
 ALLOWED_HOSTS = ["shared-tw.herokuapp.com", "api.shared-tw.icu"]
+DB_POOL = os.getenv("DB_POOL", "1") == "1"
 DATABASES["default"] = dj_database_url.config(  # noqa: F405
-    conn_max_age=600, ssl_require=True
+    engine="api.db", conn_max_age=600 if DB_POOL else 0, ssl_require=True
 )
+DATABASES["default"]["CONN_HEALTH_CHECKS"] = DB_POOL  # noqa: F405
+DATABASES["default"]["PREPARE_THRESHOLD"] = 5 if DB_POOL else None  # noqa: F405
+# Shared by all the dynos. A DatabaseCache would cost as many queries as the
+# responses it caches and its incr() is not atomic.
+if not MEMCACHED_LOCATION:  # noqa: F405
+    raise ImproperlyConfigured("MEMCACHED_LOCATION must be set")
 AUTHENTICATOR["hash_id_secret"] = os.environ["HASH_ID_SECRET"]  # noqa: F405
+# Heroku router
+AUTHENTICATOR["num_proxies"] = 1  # noqa: F405
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+if not METRICS_TOKEN:
+    raise ImproperlyConfigured(
+        "METRICS_TOKEN must be set, /metrics is public without it"
+    )
 
 if "OAUTHLIB_INSECURE_TRANSPORT" in os.environ:
     del os.environ["OAUTHLIB_INSECURE_TRANSPORT"]
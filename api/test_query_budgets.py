@@ -0,0 +1,91 @@
+import random
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from authenticator import denylist, principals
+from benchmarks.bench_api import Scenarios
+from benchmarks.stub_line import StubLineServer
+from oauth2 import line
+from share import seed
+
+# The most queries of a call of each route of `benchmarks.bench_api`, with the
+# caches cleared. They must not depend on the size of the data, e.g. the items
+# of a page must not load their organization or donations one by one. The CI
+# runs them on memcached like production, a cache in the database would add
+# its own queries.
+BUDGETS = {
+    "POST /registration/organization": 3,
+    "POST /registration/donator": 9,
+    "GET /required-items": 2,
+    "GET /organization/required-items": 3,
+    "POST /organization/required-items": 3,
+    "DELETE /organization/required-items/{id}": 13,
+    "PATCH /organization/donations/{id}": 12,
+    "POST /required-items/donations": 8,
+    "GET /donations": 2,
+    "PATCH /donations": 9,
+    "GET /users/me (organization)": 1,
+    "GET /users/me (donator)": 1,
+    "POST /auth/token": 1,
+    "POST /auth/token/refresh": 1,
+    "POST /auth/logout": 5,
+    "GET /auth/verify-email": 2,
+    "GET /oauth/line/login": 0,
+    # The last_login of the new, unverified user is written at once
+    "GET /oauth/line/callback": 7,
+}
+
+
+# Hashing the passwords is not the point
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class QueryBudgetTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubLineServer()
+        cls.stub.start()
+        cls.addClassCleanup(cls.stub.stop)
+        patcher = mock.patch.object(
+            line, "client", line.create_client(line_api_url=cls.stub.url)
+        )
+        patcher.start()
+        cls.addClassCleanup(patcher.stop)
+
+    def assertQueryBudget(self, dataset):
+        routes = Scenarios(dataset, random.Random(0)).routes()
+        self.assertEqual(routes.keys(), BUDGETS.keys())
+        for route, prepare in routes.items():
+            with self.subTest(route=route):
+                call = prepare(0)
+                # The misses of the caches are counted
+                cache.clear()
+                principals.principals.clear()
+                denylist.tokens.refresh(force=True)
+                with CaptureQueriesContext(connection) as captured:
+                    resp = call()
+
+                self.assertLess(resp.status_code, 400, resp.content)
+                if len(captured) > BUDGETS[route]:
+                    queries = "\n".join(
+                        f"{i}. {query['sql']}"
+                        for i, query in enumerate(captured.captured_queries, 1)
+                    )
+                    self.fail(
+                        f"{len(captured)} queries of {route}, the budget is "
+                        f"{BUDGETS[route]}:\n{queries}"
+                    )
+
+    def test_small(self):
+        self.assertQueryBudget(
+            seed.seed(organizations=2, donators=2, required_items=6, donations=20)
+        )
+
+    def test_large(self):
+        # Full pages, each item with a few donations
+        self.assertQueryBudget(
+            seed.seed(organizations=4, donators=4, required_items=120, donations=600)
+        )
@@ -0,0 +1,155 @@
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from prometheus_client import REGISTRY
+
+from share import models, seed, states
+
+from .db.base import PreparedStatements, to_server_placeholders
+
+User = get_user_model()
+
+
+class DatabaseBackendTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user")
+        self.reset_prepared_statements(2)
+        self.addCleanup(self.reset_prepared_statements, connection.prepare_threshold)
+
+    def reset_prepared_statements(self, threshold):
+        # Of the other tests on the same session too, e.g. with DB_POOL=1
+        with connection.cursor() as cursor:
+            cursor.execute("DEALLOCATE ALL")
+        connection.prepared_statements = None
+        if threshold is not None:
+            connection.prepared_statements = PreparedStatements(connection, threshold)
+
+    def prepared_statements(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT statement FROM pg_prepared_statements")
+            return [row[0] for row in cursor.fetchall()]
+
+    def test_placeholders(self):
+        self.assertEqual(
+            to_server_placeholders("SELECT %s, '100%%' WHERE a = %s"),
+            "SELECT $1, '100%' WHERE a = $2",
+        )
+
+    def test_prepare_after_threshold(self):
+        self.assertEqual(User.objects.get(id=self.user.id), self.user)
+        self.assertEqual(self.prepared_statements(), [])
+        for _ in range(2):
+            self.assertEqual(User.objects.get(id=self.user.id), self.user)
+        statements = [s for s in self.prepared_statements() if "auth_user" in s]
+        self.assertEqual(len(statements), 1)
+        self.assertIn('WHERE "auth_user"."id" = $1', statements[0])
+
+    def test_queries_show_original_sql(self):
+        with CaptureQueriesContext(connection) as captured:
+            for _ in range(3):
+                User.objects.get(id=self.user.id)
+        self.assertEqual(len(self.prepared_statements()), 1)
+        for query in captured.captured_queries:
+            self.assertIn(f'WHERE "auth_user"."id" = {self.user.id}', query["sql"])
+
+    def test_unpreparable_keeps_transaction(self):
+        with connection.cursor() as cursor:
+            for _ in range(3):
+                # The type of $1 can't be inferred
+                cursor.execute("SELECT %s IS NULL", [None])
+                self.assertEqual(cursor.fetchone(), (True,))
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_health_check(self):
+        conn = connections.create_connection("default")
+        conn.settings_dict = {
+            **conn.settings_dict,
+            "CONN_MAX_AGE": None,
+            "CONN_HEALTH_CHECKS": True,
+        }
+        conn.health_check_enabled = True
+        self.addCleanup(conn.close)
+        conn.ensure_connection()
+
+        # e.g. the database restarted between the requests
+        conn.connection.close()
+        conn.close_if_unusable_or_obsolete()
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            self.assertEqual(cursor.fetchone(), (1,))
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsTestCase(TestCase):
+    def test_request_duration(self):
+        labels = dict(method="GET", route="/required-items", status="200")
+        before = sample("sharedtw_request_duration_seconds_count", **labels)
+        self.client.get("/required-items")
+        self.assertEqual(
+            sample("sharedtw_request_duration_seconds_count", **labels), before + 1
+        )
+
+    def test_cache_requests(self):
+        cache.clear()
+        hits = sample("sharedtw_cache_requests_total", cache="response", result="hit")
+        misses = sample(
+            "sharedtw_cache_requests_total", cache="response", result="miss"
+        )
+        for _ in range(2):
+            self.client.get("/required-items")
+        self.assertEqual(
+            sample("sharedtw_cache_requests_total", cache="response", result="hit"),
+            hits + 1,
+        )
+        self.assertEqual(
+            sample("sharedtw_cache_requests_total", cache="response", result="miss"),
+            misses + 1,
+        )
+
+    @override_settings(
+        PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"]
+    )
+    def test_donation_transitions(self):
+        dataset = seed.seed(organizations=1, donators=1, required_items=1)
+        item = dataset.required_items[0]
+        item.state = states.CollectingState.state_id()
+        item.ended_date = date.today()
+        item.save()
+        donation = models.Donation.objects.create(
+            required_item=item, amount=1, created_by=dataset.donators[0].user
+        )
+        labels = dict(
+            event=states.DonationApprovedEvent.event_id(),
+            state=states.PendingDispatchState.state_id(),
+        )
+        before = sample("sharedtw_donation_transitions_total", **labels)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            donation.set_event(
+                dataset.organizations[0].user,
+                {"name": states.DonationApprovedEvent.event_id()},
+            )
+        self.assertEqual(
+            sample("sharedtw_donation_transitions_total", **labels), before + 1
+        )
+
+    def test_view(self):
+        resp = self.client.get("/metrics")
+        self.assertEqual(resp.status_code, 200)
+        content = resp.content.decode()
+        self.assertIn("sharedtw_email_queue_depth 0.0", content)
+        self.assertIn('sharedtw_db_connections{state="active"}', content)
+        self.assertIn("sharedtw_db_max_connections", content)
+
+    @override_settings(METRICS_TOKEN="token")
+    def test_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        resp = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer token")
+        self.assertEqual(resp.status_code, 200)
@@ -16,9 +16,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 
+from . import metrics
 from .api import api
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics", metrics.view),
     path("", api.urls),
 ]
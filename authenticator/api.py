@@ -4,20 +4,31 @@ from abc import ABC
 from datetime import timedelta
 from typing import Any, Optional
 
+import jwt
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.tokens import default_token_generator
 from django.contrib.sites.shortcuts import get_current_site
-from django.http import HttpRequest
+from django.http import HttpRequest, HttpResponse
 from django.http.response import HttpResponseBase, JsonResponse
 from django.utils import timezone
 from fastapi_jwt_auth import AuthJWT
-from fastapi_jwt_auth.exceptions import InvalidHeaderError, JWTDecodeError
+from fastapi_jwt_auth.exceptions import JWTDecodeError
 from ninja import Router, Schema, errors
 from ninja.security import HttpBearer
 from ninja.security.apikey import APIKeyBase
 
-from . import schemas, utils
+from . import (
+    denylist,
+    hashing,
+    last_login,
+    middleware,
+    principals,
+    ratelimit,
+    schemas,
+    utils,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +38,9 @@ router = Router(tags=["Authentication"])
 
 class Settings(Schema):
     authjwt_secret_key: str = settings.SECRET_KEY
+    authjwt_algorithm: str = "HS256"
     authjwt_access_token_expires: int = timedelta(hours=1)
+    authjwt_refresh_token_expires: int = settings.AUTHENTICATOR["refresh_token_expires"]
 
 
 @AuthJWT.load_config
@@ -35,6 +48,31 @@ def get_config():
     return Settings()
 
 
+class JWTVerifier:
+    """Verify the tokens issued by `AuthJWT`
+
+    The key and the algorithm are read from the `Settings` of AuthJWT once
+    instead of per request, and the token is decoded without parsing its
+    header twice.
+    """
+
+    def __init__(self, config: Settings):
+        # A symmetric algorithm, the secret key signs and verifies
+        self.algorithms = [config.authjwt_algorithm]
+        self.key = config.authjwt_secret_key
+
+    def decode(self, token: str) -> typing.Dict[str, Any]:
+        try:
+            return jwt.decode(token, self.key, algorithms=self.algorithms)
+        except jwt.InvalidTokenError as e:
+            raise JWTDecodeError(status_code=422, message=str(e))
+
+
+# AuthJWT keeps its settings in the class, so the instances can be shared
+_auth = AuthJWT()
+verifier = JWTVerifier(Settings())
+
+
 class RefreshTokenCookieAuth(APIKeyBase, ABC):
     """Check is refresh token exists in the Cookies"""
 
@@ -47,9 +85,12 @@ class RefreshTokenCookieAuth(APIKeyBase, ABC):
         return request.COOKIES.get(self.param_name)
 
     def authenticate(self, request: HttpRequest, key: Optional[str]) -> Optional[Any]:
-        user, decoded_token = Authenticator().authenticate_by_token(key)
-        if not user:
-            return None
+        with middleware.measure("auth"):
+            user, decoded_token = Authenticator().authenticate_by_token(
+                key, token_type="refresh"
+            )
+            if not user or denylist.tokens.is_revoked(decoded_token):
+                return None
 
         request.user = user
         return decoded_token
@@ -63,7 +104,10 @@ class JWTAuthBearer(HttpBearer):
         self.inactive_user_raise_403 = inactive_user_raise_403
 
     def authenticate(self, request, token):
-        user, decoded_token = Authenticator().authenticate_by_token(token)
+        with middleware.measure("auth"):
+            user, decoded_token = Authenticator().authenticate_by_token(
+                token, token_type="access"
+            )
         if user and not user.is_active and self.inactive_user_raise_403:
             raise errors.HttpError(403, "Please verify your email.")
         elif not user:
@@ -74,45 +118,52 @@ class JWTAuthBearer(HttpBearer):
 
 
 @router.post("/token", response=schemas.JWTToken)
-def create_jwt_token(request, payload: schemas.JWTTokenCreation):
+async def create_jwt_token(request, payload: schemas.JWTTokenCreation):
     authenticator = Authenticator()
+    if not await sync_to_async(ratelimit.allow_login)(request, payload.username):
+        raise errors.HttpError(429, "Too many login attempts, please try later.")
 
     try:
-        user = authenticator.authenticate(payload.username, payload.password)
+        user = await authenticator.authenticate_async(
+            payload.username, payload.password
+        )
         if not user.is_active:
             raise errors.HttpError(403, "Please verify your email.")
-        access_token, refresh_token = authenticator.login(user)
-        kwargs = schemas.JWTToken(access=access_token).dict()
-        return authenticator.generate_http_response(
-            request, JsonResponse, refresh_token, resp_kwargs=kwargs
-        )
+        return await sync_to_async(authenticator.login_response)(request, user)
     except User.DoesNotExist:
         raise errors.HttpError(400, "Invalid username or password")
+    except hashing.Overloaded:
+        raise errors.HttpError(503, "Server is busy, please try later.")
 
 
 @router.post("/token/refresh", auth=RefreshTokenCookieAuth(), response=schemas.JWTToken)
 def refresh_jwt_token(request):
-    authenticator = Authenticator()
-    access_token, refresh_token = authenticator.login(request.user)
-
     # workaround to set Cookie in the response, see: https://github.com/vitalik/django-ninja/issues/117
-    return authenticator.generate_http_response(
-        request,
-        JsonResponse,
-        refresh_token,
-        resp_kwargs=schemas.JWTToken(access=access_token).dict(),
+    return Authenticator().login_response(request, request.user)
+
+
+@router.post("/logout", auth=RefreshTokenCookieAuth())
+def logout(request, everywhere: bool = False):
+    if everywhere:
+        denylist.tokens.revoke_subject(request.auth["sub"])
+    else:
+        denylist.tokens.revoke(request.auth)
+
+    resp = HttpResponse(status=204)
+    resp.delete_cookie(
+        RefreshTokenCookieAuth.param_name,
+        domain=Authenticator.cookie_domain(request),
+        samesite="Strict",
     )
+    return resp
 
 
 @router.get("/verify-email", response=schemas.JWTToken)
-def verify_email(request, uid: str, token: str):
+async def verify_email(request, uid: str, token: str):
     authenticator = Authenticator()
     try:
-        access_token, refresh_token = authenticator.verify_email(uid, token)
-        kwargs = schemas.JWTToken(access=access_token).dict()
-        return authenticator.generate_http_response(
-            request, JsonResponse, refresh_token, resp_kwargs=kwargs
-        )
+        user = await sync_to_async(authenticator.verify_email)(uid, token)
+        return await sync_to_async(authenticator.login_response)(request, user)
     except Exception as e:
         logger.warning("Invalid user or token: %s=%s, err: %s", uid, token, e)
         raise errors.HttpError(401, "Invalid user or token")
@@ -120,14 +171,13 @@ def verify_email(request, uid: str, token: str):
 
 class Authenticator:
     def __init__(self):
-        self.auth = AuthJWT()
+        self.auth = _auth
 
     def login(
         self,
         user,
     ) -> typing.Tuple[str, str]:
-        user.last_login = timezone.now()
-        user.save(update_fields=["last_login"])
+        last_login.update_last_login(user, timezone.now())
 
         user_id = utils.encode_id(user.id)
         return (
@@ -137,13 +187,20 @@ class Authenticator:
             self.auth.create_refresh_token(subject=user_id),
         )
 
-    def verify_email(self, encoded_id: str, token: str) -> typing.Tuple[str, str]:
+    def login_response(self, request, user) -> JsonResponse:
+        access_token, refresh_token = self.login(user)
+        kwargs = schemas.JWTToken(access=access_token).dict()
+        return self.generate_http_response(
+            request, JsonResponse, refresh_token, resp_kwargs=kwargs
+        )
+
+    def verify_email(self, encoded_id: str, token: str) -> User:
         user = User.objects.get(id=utils.decode_id(encoded_id))
         if not default_token_generator.check_token(user, token):
             raise ValueError("Invalid or expired token")
         user.is_active = True
         user.save()
-        return self.login(user)
+        return user
 
     def generate_one_time_token(self, user) -> str:
         return f"{utils.encode_id(user.id)}_{default_token_generator.make_token(user)}"
@@ -158,13 +215,27 @@ class Authenticator:
 
     def authenticate(self, username: str, password: str) -> User:
         user = User.objects.get(username=username)
-        if not user.check_password(password):
+        if not hashing.check_password(password, user.password):
+            raise User.DoesNotExist()
+        return user
+
+    async def authenticate_async(self, username: str, password: str) -> User:
+        user = await sync_to_async(User.objects.get)(username=username)
+        if not await hashing.check_password_async(password, user.password):
             raise User.DoesNotExist()
         return user
 
     def authenticate_by_token(
-        self, token: str, is_active: typing.Optional[bool] = None
+        self,
+        token: str,
+        is_active: typing.Optional[bool] = None,
+        token_type: typing.Optional[str] = None,
     ) -> typing.Tuple[typing.Optional[User], typing.Optional[str]]:
+        """Return the user of the token, `token_type` is "access" or "refresh"
+
+        The type must be checked, e.g. a refresh token must not be accepted
+        as an access token, which would skip the denylist of the logouts.
+        """
         user = None
         decoded_token = None
 
@@ -173,22 +244,28 @@ class Authenticator:
             kwargs["is_active"] = is_active
 
         try:
-            decoded_token = self.auth.get_raw_jwt(token)
-            if decoded_token is None:
+            if not token:
                 raise ValueError(f"unable to decode: {token}")
-            user_id = utils.decode_id(decoded_token["sub"])
-            user = User.objects.get(id=user_id, **kwargs)
+            decoded_token = verifier.decode(token)
+            if token_type is not None and decoded_token.get("type") != token_type:
+                raise ValueError(f"expected a {token_type} token")
+            user = principals.get_user(decoded_token["sub"], **kwargs)
         except User.DoesNotExist:
             logger.warning("User doesn't exist: %s", decoded_token)
         except JWTDecodeError as e:
             logger.warning("Fail to verify the token: %s", e.message)
         except ValueError as e:
             logger.warning("Malformed token: %s", e)
-        except InvalidHeaderError as e:
-            logger.warning("Invalid token header: %s", e.message)
 
         return user, decoded_token
 
+    @staticmethod
+    def cookie_domain(request):
+        if settings.DEBUG:
+            site = get_current_site(request)
+            return (site.domain.split(":", 1)[0],)  # remove port
+        return "shared-tw.icu"
+
     @staticmethod
     def generate_http_response(
         request,
@@ -197,12 +274,7 @@ class Authenticator:
         resp_kwargs: typing.Dict = None,
         unpack_resp_kwargs: bool = False,
     ) -> HttpResponseBase:
-        if settings.DEBUG:
-            site = get_current_site(request)
-            domain = (site.domain.split(":", 1)[0],)  # remove port
-        else:
-            domain = "shared-tw.icu"
-
+        domain = Authenticator.cookie_domain(request)
         if resp_kwargs is None:
             resp_kwargs = {}
 
@@ -216,6 +288,6 @@ class Authenticator:
             httponly=True,
             domain=domain,
             samesite="Strict",
-            max_age=timedelta(days=7).total_seconds(),
+            max_age=settings.AUTHENTICATOR["refresh_token_expires"].total_seconds(),
         )
         return resp
@@ -0,0 +1,120 @@
+import logging
+import math
+import threading
+import time
+import typing
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# Covers the clock skew of the nodes and the rows which are committed late
+SYNC_OVERLAP = timedelta(seconds=60)
+
+
+class Denylist:
+    """Per-process copy of `RevokedToken`
+
+    A check is a set lookup. The copy is refreshed from the database at most
+    every `refresh_interval` seconds by fetching the rows created since the
+    last sync, so a revocation reaches the other processes within that time.
+    The revocations of this process apply immediately.
+    """
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        # jti -> expiry timestamp
+        self._jtis: typing.Dict[str, float] = {}
+        # subject -> the tokens issued until this timestamp are revoked
+        self._subjects: typing.Dict[str, typing.Tuple[float, float]] = {}
+        self._synced_at: typing.Optional[datetime] = None
+        self._checked_at = -math.inf
+        self._lock = threading.Lock()
+
+    def _add(self, row: models.RevokedToken):
+        expires_at = row.expires_at.timestamp()
+        if row.jti is not None:
+            self._jtis[row.jti] = expires_at
+            return
+        revoked_until = row.created_at.timestamp()
+        previous = self._subjects.get(row.subject)
+        if previous is None or previous[0] < revoked_until:
+            self._subjects[row.subject] = (revoked_until, expires_at)
+
+    def _prune(self, now: float):
+        self._jtis = {k: v for k, v in self._jtis.items() if v > now}
+        self._subjects = {k: v for k, v in self._subjects.items() if v[1] > now}
+
+    def refresh(self, force: bool = False):
+        if not force and time.monotonic() - self._checked_at < self.refresh_interval:
+            return
+        # One thread refreshes, the others keep using the current copy
+        if not self._lock.acquire(blocking=force):
+            return
+        try:
+            now = timezone.now()
+            rows = models.RevokedToken.objects.filter(expires_at__gt=now)
+            if self._synced_at is not None:
+                rows = rows.filter(created_at__gte=self._synced_at - SYNC_OVERLAP)
+            count = 0
+            for row in rows.only("jti", "subject", "expires_at", "created_at"):
+                self._add(row)
+                count += 1
+            logger.debug("Synced %d revoked tokens", count)
+            self._prune(now.timestamp())
+            self._synced_at = now
+            self._checked_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def is_revoked(self, token: typing.Dict[str, typing.Any]) -> bool:
+        self.refresh()
+        if token.get("jti") in self._jtis:
+            return True
+        entry = self._subjects.get(token.get("sub"))
+        # `iat` has no fraction, so a token issued in the same second counts
+        return entry is not None and token.get("iat", 0) <= entry[0]
+
+    def revoke(self, token: typing.Dict[str, typing.Any]):
+        """Revoke the decoded refresh token"""
+        row, _ = models.RevokedToken.objects.get_or_create(
+            jti=token["jti"],
+            defaults=dict(
+                subject=token["sub"],
+                expires_at=datetime.fromtimestamp(token["exp"], timezone.utc),
+            ),
+        )
+        with self._lock:
+            self._add(row)
+
+    def revoke_subject(self, subject: str):
+        """Revoke every refresh token which is issued to `subject` until now"""
+        now = timezone.now()
+        row = models.RevokedToken.objects.create(
+            subject=subject,
+            created_at=now,
+            expires_at=now + settings.AUTHENTICATOR["refresh_token_expires"],
+        )
+        with self._lock:
+            self._add(row)
+
+    def clear(self):
+        with self._lock:
+            self._jtis.clear()
+            self._subjects.clear()
+            self._synced_at = None
+            self._checked_at = -math.inf
+
+
+tokens = Denylist(settings.AUTHENTICATOR["denylist_refresh_interval"])
+
+
+def purge_expired() -> int:
+    deleted, _ = models.RevokedToken.objects.filter(
+        expires_at__lte=timezone.now()
+    ).delete()
+    return deleted
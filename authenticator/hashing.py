@@ -0,0 +1,84 @@
+import asyncio
+import threading
+import typing
+from concurrent import futures
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class Overloaded(Exception):
+    pass
+
+
+class HashingPool:
+    """Bounded executor of the password hashing
+
+    PBKDF2 releases the GIL, so with threaded workers the other requests keep
+    being served while the passwords are hashed. At most `max_pending` hashes
+    are admitted at once, the others fail fast with `Overloaded` instead of
+    queueing up behind each other. So do the hashes which are not done in
+    `timeout` seconds.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, timeout: float):
+        self.timeout = timeout
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="password-hashing"
+        )
+        self._admission = threading.BoundedSemaphore(max_pending)
+
+    def run(self, func: typing.Callable, *args) -> typing.Any:
+        future = self._submit(func, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except futures.TimeoutError:
+            # Drop it from the queue, the hash might already be running
+            future.cancel()
+            raise Overloaded()
+
+    async def run_async(self, func: typing.Callable, *args) -> typing.Any:
+        """Like `run()` but the event loop is free while the hash is computed"""
+        future = asyncio.wrap_future(self._submit(func, *args))
+        try:
+            # Cancels the future on the timeout
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise Overloaded()
+
+    def _submit(self, func: typing.Callable, *args) -> futures.Future:
+        """Submit the hash if it is admitted
+
+        The admission is released once the hash is done or cancelled, not when
+        the caller gives up, so that the queue is bounded by `max_pending`.
+        """
+        if not self._admission.acquire(blocking=False):
+            raise Overloaded()
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._admission.release()
+            raise
+        future.add_done_callback(lambda _: self._admission.release())
+        return future
+
+
+pool = HashingPool(
+    max_workers=settings.AUTHENTICATOR["password_hashing_workers"],
+    max_pending=settings.AUTHENTICATOR["password_hashing_max_pending"],
+    timeout=settings.AUTHENTICATOR["password_hashing_timeout"],
+)
+
+
+def make_password(password: str) -> str:
+    return pool.run(hashers.make_password, password)
+
+
+def check_password(password: str, encoded: str) -> bool:
+    # Without the setter of User.check_password which saves the upgraded hash,
+    # the pool must not touch the database.
+    return pool.run(hashers.check_password, password, encoded)
+
+
+async def check_password_async(password: str, encoded: str) -> bool:
+    return await pool.run_async(hashers.check_password, password, encoded)
@@ -0,0 +1,76 @@
+import atexit
+import logging
+import os
+import threading
+import time
+import typing
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+
+class LastLoginBuffer:
+    """Write-behind buffer of `User.last_login`
+
+    The latest login time of each user is kept in memory and written in one
+    bulk UPDATE every `interval` seconds and at the exit of the process.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._pending: typing.Dict[int, datetime] = {}
+        self._lock = threading.Lock()
+        self._worker_pid = None
+
+    def record(self, user_id: int, timestamp: datetime):
+        with self._lock:
+            self._pending[user_id] = timestamp
+            # The worker doesn't survive a fork, e.g. gunicorn --preload
+            if self._worker_pid != os.getpid():
+                self._worker_pid = os.getpid()
+                threading.Thread(
+                    target=self._run, name="last-login-flusher", daemon=True
+                ).start()
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        User.objects.bulk_update(
+            [User(id=user_id, last_login=t) for user_id, t in pending.items()],
+            ["last_login"],
+        )
+        logger.debug("Flushed last_login of %d users", len(pending))
+        return len(pending)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Fail to flush last_login")
+            finally:
+                connections.close_all()
+
+
+buffer = LastLoginBuffer(settings.AUTHENTICATOR["last_login_flush_interval"])
+atexit.register(buffer.flush)
+
+
+def update_last_login(user, timestamp: datetime):
+    user.last_login = timestamp
+    # The email verification tokens hash last_login, a token made before the
+    # flush would be invalidated by it.
+    if settings.AUTHENTICATOR["last_login_write_behind"] and user.is_active:
+        buffer.record(user.id, timestamp)
+    else:
+        user.save(update_fields=["last_login"])
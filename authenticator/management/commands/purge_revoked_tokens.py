@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from authenticator import denylist
+
+
+class Command(BaseCommand):
+    help = "Delete the revoked refresh tokens which are expired anyway"
+
+    def handle(self, *args, **options):
+        deleted = denylist.purge_expired()
+        self.stdout.write(f"Deleted {deleted} revoked tokens")
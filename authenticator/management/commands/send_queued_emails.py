@@ -0,0 +1,38 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from authenticator import outbox
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Send the queued emails"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Keep running and check the queue every INTERVAL seconds",
+        )
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            try:
+                # Drain the queue before waiting for the next round
+                while outbox.send_queued(options["batch_size"]):
+                    pass
+            except Exception:
+                if not options["interval"]:
+                    raise
+                logger.exception("Fail to send the queued emails")
+
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -1,15 +1,218 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
 from django.http import JsonResponse
+from django.utils.deprecation import MiddlewareMixin
 from ninja.errors import HttpError
 
+logger = logging.getLogger(__name__)
 
-class Status403Middleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
 
-    def __call__(self, request):
-        return self.get_response(request)
+class Status403Middleware(MiddlewareMixin):
+    # MiddlewareMixin is async capable, a sync-only middleware would make the
+    # async views run in the thread of the sync views under ASGI.
 
     def process_exception(self, request, exception):
         if isinstance(exception, HttpError) and exception.status_code == 403:
             return JsonResponse(dict(message=str(exception)), status=403)
         return None
+
+
+class Timings:
+    """Where the time of a request goes, in seconds"""
+
+    __slots__ = ("db", "queries", "auth", "view", "view_ended_at")
+
+    def __init__(self):
+        self.db = 0.0
+        self.queries = 0
+        self.auth = 0.0
+        self.view = 0.0
+        self.view_ended_at = None
+
+
+# A context variable follows the request into the threads of sync_to_async
+_current = contextvars.ContextVar("timings", default=None)
+
+
+@contextlib.contextmanager
+def measure(name: str):
+    """Add the time of the block to the `name` timing of the current request"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(timings, name, getattr(timings, name) + time.perf_counter() - start)
+
+
+def _time_queries(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - start
+        timings.queries += 1
+
+
+@receiver(connection_created)
+def _install_query_timing(sender, connection, **kwargs):
+    if not settings.AUTHENTICATOR["server_timing"]:
+        return
+    # Outermost, before the wrappers of `connection.execute_wrapper()` blocks
+    if _time_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _time_queries)
+
+
+def instrument_view(view_func):
+    """Measure the view of a django-ninja operation, see `instrument_api`"""
+
+    def done(timings, start):
+        timings.view_ended_at = time.perf_counter()
+        timings.view += timings.view_ended_at - start
+
+    if asyncio.iscoroutinefunction(view_func):
+
+        @functools.wraps(view_func)
+        async def async_wrapper(request, **kwargs):
+            timings = _current.get()
+            if timings is None:
+                return await view_func(request, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await view_func(request, **kwargs)
+            finally:
+                done(timings, start)
+
+        return async_wrapper
+
+    @functools.wraps(view_func)
+    def wrapper(request, **kwargs):
+        timings = _current.get()
+        if timings is None:
+            return view_func(request, **kwargs)
+        start = time.perf_counter()
+        try:
+            return view_func(request, **kwargs)
+        finally:
+            done(timings, start)
+
+    return wrapper
+
+
+def instrument_api(api):
+    """Wrap the views of the operations of the NinjaAPI `api`
+
+    The operations have already parsed the signatures of the views, so the
+    wrappers don't change the parameters nor the OpenAPI schema.
+    """
+    if not settings.AUTHENTICATOR["server_timing"]:
+        return
+    for _, router in api._routers:
+        for path_view in router.path_operations.values():
+            for operation in path_view.operations:
+                operation.view_func = instrument_view(operation.view_func)
+
+
+class ServerTimingMiddleware:
+    """Report the timings of each request
+
+    The database time and the number of the queries, the authentication, the
+    view and the serialization of the response (from the end of the view until
+    the response reaches this middleware, it should be the last one) go to the
+    Server-Timing header and to a debug log line. A request over the
+    `slow_request_ms` or the `slow_request_queries` setting is logged as a
+    warning. The middleware is removed when the `server_timing` setting is off.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.AUTHENTICATOR["server_timing"]:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Mark the instance as a coroutine function, like MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        # The connections opened before the middleware is loaded
+        for connection in connections.all():
+            _install_query_timing(None, connection)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = Timings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.report(request, response, timings, start)
+        return response
+
+    async def __acall__(self, request):
+        timings = Timings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.report(request, response, timings, start)
+        return response
+
+    def report(self, request, response, timings: Timings, start: float):
+        end = time.perf_counter()
+        total = end - start
+        serialize = end - timings.view_ended_at if timings.view_ended_at else 0.0
+
+        response["Server-Timing"] = ", ".join(
+            [
+                f'db;dur={timings.db * 1000:.1f};desc="{timings.queries} queries"',
+                f"auth;dur={timings.auth * 1000:.1f}",
+                f"view;dur={timings.view * 1000:.1f}",
+                f"serialize;dur={serialize * 1000:.1f}",
+                f"total;dur={total * 1000:.1f}",
+            ]
+        )
+
+        config = settings.AUTHENTICATOR
+        level = logging.DEBUG
+        if (
+            total * 1000 > config["slow_request_ms"]
+            or timings.queries > config["slow_request_queries"]
+        ):
+            level = logging.WARNING
+        if logger.isEnabledFor(level):
+            match = request.resolver_match
+            logger.log(
+                level,
+                "method=%s route=%s status=%d total_ms=%.1f db_ms=%.1f queries=%d "
+                "auth_ms=%.1f view_ms=%.1f serialize_ms=%.1f",
+                request.method,
+                match.route if match else request.path,
+                response.status_code,
+                total * 1000,
+                timings.db * 1000,
+                timings.queries,
+                timings.auth * 1000,
+                timings.view * 1000,
+                serialize * 1000,
+            )
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:36
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authenticator", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RevokedToken",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("jti", models.CharField(max_length=64, null=True, unique=True)),
+                ("subject", models.CharField(max_length=64)),
+                ("expires_at", models.DateTimeField()),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="revokedtoken",
+            index=models.Index(
+                fields=["created_at"], name="authenticat_created_f21ce7_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="revokedtoken",
+            index=models.Index(
+                fields=["expires_at"], name="authenticat_expires_bc6353_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+
+class OutgoingEmail(models.Model):
+    """Outbox of the emails, they are sent by `authenticator.outbox`"""
+
+    subject = models.CharField(max_length=256)
+    body = models.TextField()
+    html = models.TextField(blank=True, default="")
+    to = models.JSONField(default=list)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    sent_at = models.DateTimeField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=Q(sent_at__isnull=True),
+                name="authenticator_email_queue_idx",
+            ),
+        ]
+
+
+class RevokedToken(models.Model):
+    """Denylist of the refresh tokens, see `authenticator.denylist`
+
+    A row revokes the token `jti`, or every token of `subject` which is issued
+    until `created_at` if `jti` is null (sign out everywhere). The row is kept
+    until `expires_at`, when the revoked tokens expire anyway.
+    """
+
+    jti = models.CharField(max_length=64, unique=True, null=True)
+    subject = models.CharField(max_length=64)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"]),
+            models.Index(fields=["expires_at"]),
+        ]
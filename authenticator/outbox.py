@@ -0,0 +1,112 @@
+import logging
+import typing
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(msg: EmailMultiAlternatives) -> models.OutgoingEmail:
+    html = ""
+    for content, mimetype in msg.alternatives:
+        if mimetype == "text/html":
+            html = content
+    return models.OutgoingEmail.objects.create(
+        subject=msg.subject, body=msg.body, html=html, to=msg.to
+    )
+
+
+def retry_delay(attempts: int) -> timedelta:
+    config = settings.AUTHENTICATOR
+    seconds = config["email_retry_backoff"] * 2 ** (attempts - 1)
+    return timedelta(seconds=min(seconds, config["email_max_retry_delay"]))
+
+
+def claim(batch_size: int) -> typing.List[models.OutgoingEmail]:
+    """Claim a batch of the due emails for one attempt
+
+    The rows are locked with SKIP LOCKED only while their attempt is counted
+    and their next attempt is postponed by `AUTHENTICATOR["email_claim_timeout"]`,
+    so that other workers skip them while they are sent and a crashed worker
+    doesn't lose them.
+    """
+    config = settings.AUTHENTICATOR
+    with transaction.atomic():
+        emails = list(
+            models.OutgoingEmail.objects.filter(
+                sent_at__isnull=True,
+                next_attempt_at__lte=timezone.now(),
+                attempts__lt=config["email_max_attempts"],
+            )
+            .order_by("next_attempt_at")
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        claimed_until = timezone.now() + timedelta(
+            seconds=config["email_claim_timeout"]
+        )
+        for email in emails:
+            email.attempts += 1
+            email.next_attempt_at = claimed_until
+        models.OutgoingEmail.objects.bulk_update(
+            emails, ["attempts", "next_attempt_at"]
+        )
+    return emails
+
+
+def to_message(email: models.OutgoingEmail, connection) -> EmailMultiAlternatives:
+    msg = EmailMultiAlternatives(
+        email.subject, email.body, to=email.to, connection=connection
+    )
+    if email.html:
+        msg.attach_alternative(email.html, "text/html")
+    return msg
+
+
+def fail(email: models.OutgoingEmail, error: Exception):
+    logger.warning("Fail to send email %s: %s", email.id, error)
+    email.last_error = str(error)
+    email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+
+
+def send_queued(batch_size: int = None) -> int:
+    """Send a batch of the queued emails over one connection
+
+    The batch is claimed in a short transaction and sent outside of it. A failed
+    email, including a failure to connect, is retried with exponential backoff
+    until `AUTHENTICATOR["email_max_attempts"]`. Returns the number of the sent
+    emails.
+    """
+    if batch_size is None:
+        batch_size = settings.AUTHENTICATOR["email_batch_size"]
+
+    emails = claim(batch_size)
+    if not emails:
+        return 0
+
+    done = set()
+    try:
+        with get_connection(fail_silently=False) as connection:
+            for email in emails:
+                try:
+                    to_message(email, connection).send()
+                except Exception as e:
+                    fail(email, e)
+                else:
+                    email.sent_at = timezone.now()
+                done.add(email.id)
+    except Exception as e:
+        # Fail to open or to close the connection, e.g. the SMTP server is down
+        for email in emails:
+            if email.id not in done:
+                fail(email, e)
+
+    models.OutgoingEmail.objects.bulk_update(
+        emails, ["next_attempt_at", "last_error", "sent_at"]
+    )
+    return sum(email.sent_at is not None for email in emails)
@@ -0,0 +1,110 @@
+import copy
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api import metrics
+
+from . import utils
+
+User = get_user_model()
+
+
+class PrincipalCache:
+    """Per-process LRU cache of the authenticated users
+
+    The users are keyed on the subject of the tokens and are cached with
+    their profiles (see `AUTHENTICATOR["profile_related_names"]`), so an
+    authenticated request doesn't query the database. Saving the user (or the
+    profiles, see `share.models`) invalidates the entry of this process, the
+    other processes catch up after `ttl` seconds.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self._entries: "OrderedDict[str, typing.Tuple[float, User]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    def get(self, subject: str) -> typing.Optional[User]:
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self._entries[subject]
+                return None
+            self._entries.move_to_end(subject)
+        # Each request gets its own copy to modify
+        return copy.copy(user)
+
+    def set(self, subject: str, user: User, generation: int):
+        """Cache the user unless something is invalidated since `generation`"""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[subject] = (time.monotonic() + self.ttl, copy.copy(user))
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        subject = utils.encode_id(user_id)
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(subject, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+principals = PrincipalCache(
+    maxsize=settings.AUTHENTICATOR["principal_cache_size"],
+    ttl=settings.AUTHENTICATOR["principal_cache_ttl"],
+)
+
+
+def get_user(subject: str, **kwargs) -> User:
+    """Return the user of the token subject with its profiles"""
+    generation = principals.generation
+    user = principals.get(subject)
+    metrics.count_cache("principal", hit=user is not None)
+    if user is None:
+        user = User.objects.select_related(
+            *settings.AUTHENTICATOR["profile_related_names"]
+        ).get(id=utils.decode_id(subject))
+        principals.set(subject, user, generation)
+
+    for attr, value in kwargs.items():
+        if getattr(user, attr) != value:
+            raise User.DoesNotExist()
+    return user
+
+
+def invalidate_on_commit(user_id: int):
+    # Again on commit, the user might be cached from the not yet committed data
+    principals.invalidate(user_id)
+    transaction.on_commit(lambda: principals.invalidate(user_id))
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    invalidate_on_commit(instance.id)
@@ -0,0 +1,68 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class SlidingWindowLimiter:
+    """Allow `limit` hits per `window` seconds of each identity
+
+    The sliding window is approximated by weighting the count of the previous
+    fixed window, so a check costs a few cache operations regardless of the
+    traffic. The counters live in Django's cache and are shared by the
+    processes if the cache is. Its incr() must be atomic, e.g. memcached's,
+    otherwise a burst of concurrent hits is undercounted; the DatabaseCache's
+    is not.
+    """
+
+    def __init__(self, name: str, limit: int, window: int):
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    def _key(self, identity: str, slot: int) -> str:
+        # The identities are user input, e.g. with spaces which memcached keys
+        # can't contain.
+        digest = hashlib.md5(identity.encode()).hexdigest()
+        return f"ratelimit:{self.name}:{digest}:{slot}"
+
+    def hit(self, identity: str) -> bool:
+        """Count a hit and return whether it is allowed"""
+        now = time.time()
+        slot, offset = divmod(now, self.window)
+        key = self._key(identity, int(slot))
+
+        timeout = self.window * 2
+        cache.add(key, 0, timeout=timeout)
+        try:
+            count = cache.incr(key)
+        except ValueError:  # expired in between
+            # Not set(), which would drop the concurrent hits
+            count = 1 if cache.add(key, 1, timeout=timeout) else cache.incr(key)
+        previous = cache.get(self._key(identity, int(slot) - 1), 0)
+        return previous * (1 - offset / self.window) + count <= self.limit
+
+
+login_limiters = {
+    name: SlidingWindowLimiter(f"login-{name}", limit, window)
+    for name, (limit, window) in settings.AUTHENTICATOR["login_rate_limits"].items()
+}
+
+
+def get_client_ip(request) -> str:
+    num_proxies = settings.AUTHENTICATOR["num_proxies"]
+    if num_proxies:
+        forwarded_for = request.headers.get("X-Forwarded-For", "").split(",")
+        if len(forwarded_for) >= num_proxies:
+            return forwarded_for[-num_proxies].strip()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def allow_login(request, username: str) -> bool:
+    identities = {"username": username, "ip": get_client_ip(request)}
+    # Count every identity even if one of them is already limited
+    allowed = [
+        limiter.hit(identities[name]) for name, limiter in login_limiters.items()
+    ]
+    return all(allowed)
@@ -0,0 +1,428 @@
+import threading
+from smtplib import SMTPException
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import (
+    denylist,
+    hashing,
+    last_login,
+    middleware,
+    models,
+    outbox,
+    ratelimit,
+    utils,
+)
+from .api import Authenticator, verifier
+
+User = get_user_model()
+
+
+class HashIdTestCase(TestCase):
+    def test_round_trip(self):
+        for id in [1, 2, 12345]:
+            data = utils.encode_id(id)
+            # Compatible with the issued tokens
+            self.assertEqual(data, utils._hashids.encode(id))
+            self.assertEqual(utils.decode_id(data), id)
+
+    def test_invalid(self):
+        for data in ["", "!!!", utils._hashids.encode(1, 2)]:
+            with self.assertRaises(ValueError):
+                utils.decode_id(data)
+        with self.assertRaises(ValueError):
+            utils.encode_id(-1)
+
+    def test_invalid_token_subject(self):
+        token = Authenticator().auth.create_access_token(subject="!!!")
+        user, decoded_token = Authenticator().authenticate_by_token(token)
+        self.assertIsNone(user)
+
+
+class LastLoginTestCase(TestCase):
+    def setUp(self):
+        last_login.buffer.flush()  # left by the other tests
+        self.user = User.objects.create_user(username="user", password="password")
+
+    @override_settings(
+        AUTHENTICATOR={**settings.AUTHENTICATOR, "last_login_write_behind": True}
+    )
+    def test_write_behind(self):
+        with self.assertNumQueries(0):
+            Authenticator().login(self.user)
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.last_login)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(last_login.buffer.flush(), 1)
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+
+    @override_settings(
+        AUTHENTICATOR={**settings.AUTHENTICATOR, "last_login_write_behind": True}
+    )
+    def test_verification_token_survives_flush(self):
+        # e.g. the first LINE login, then the donator registration
+        self.user.is_active = False
+        self.user.save()
+        Authenticator().login(self.user)
+        user = User.objects.get(id=self.user.id)
+        token = default_token_generator.make_token(user)
+
+        last_login.buffer.flush()
+        user.refresh_from_db()
+        self.assertTrue(default_token_generator.check_token(user, token))
+
+    @override_settings(
+        AUTHENTICATOR={**settings.AUTHENTICATOR, "last_login_write_behind": False}
+    )
+    def test_write_through(self):
+        Authenticator().login(self.user)
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+
+
+class OutboxTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="user", password="password", email="user@example.com"
+        )
+
+    def test_verification_email_is_queued(self):
+        request = RequestFactory().get("/")
+        utils.send_verification_email(request, self.user)
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(outbox.send_queued(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["user@example.com"])
+        self.assertEqual(mail.outbox[0].alternatives[0][1], "text/html")
+        self.assertEqual(outbox.send_queued(), 0)
+
+    def test_batches_share_one_connection(self):
+        for i in range(3):
+            models.OutgoingEmail.objects.create(subject=str(i), body="", to=["a@b.c"])
+
+        with mock.patch.object(
+            outbox, "get_connection", wraps=outbox.get_connection
+        ) as get_connection:
+            self.assertEqual(outbox.send_queued(batch_size=2), 2)
+            self.assertEqual(outbox.send_queued(batch_size=2), 1)
+        self.assertEqual(get_connection.call_count, 2)
+
+    def test_retry_with_backoff(self):
+        email = models.OutgoingEmail.objects.create(
+            subject="subject", body="", to=["a@b.c"]
+        )
+        with mock.patch.object(
+            mail.EmailMultiAlternatives, "send", side_effect=SMTPException("down")
+        ):
+            self.assertEqual(outbox.send_queued(), 0)
+
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.last_error, "down")
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        # Not due yet
+        self.assertEqual(outbox.send_queued(), 0)
+
+        models.OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(outbox.send_queued(), 1)
+        email.refresh_from_db()
+        self.assertIsNotNone(email.sent_at)
+
+    def test_retry_connection_failure(self):
+        email = models.OutgoingEmail.objects.create(
+            subject="subject", body="", to=["a@b.c"]
+        )
+        with mock.patch.object(
+            outbox, "get_connection", side_effect=SMTPException("refused")
+        ):
+            self.assertEqual(outbox.send_queued(), 0)
+            # Postponed, not retried at once
+            self.assertEqual(outbox.send_queued(), 0)
+
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.last_error, "refused")
+        self.assertIsNone(email.sent_at)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+
+    def test_claimed_emails_are_skipped(self):
+        models.OutgoingEmail.objects.create(subject="subject", body="", to=["a@b.c"])
+
+        claimed = outbox.claim(batch_size=10)
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(claimed[0].attempts, 1)
+        # Until the claim times out, e.g. the worker crashed while sending
+        self.assertEqual(outbox.claim(batch_size=10), [])
+        self.assertEqual(outbox.send_queued(), 0)
+
+        models.OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(outbox.send_queued(), 1)
+
+
+class LoginThrottlingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username="user", password="password")
+
+    def login(self, password="password"):
+        return self.client.post(
+            "/auth/token",
+            {"username": "user", "password": password},
+            content_type="application/json",
+        )
+
+    def test_rate_limit_by_username(self):
+        limit, _ = settings.AUTHENTICATOR["login_rate_limits"]["username"]
+        for _ in range(limit):
+            self.assertEqual(self.login("wrong").status_code, 400)
+        self.assertEqual(self.login().status_code, 429)
+
+    def test_sliding_window(self):
+        limiter = ratelimit.SlidingWindowLimiter("test", limit=2, window=60)
+        with mock.patch.object(ratelimit.time, "time", return_value=60.0):
+            self.assertTrue(limiter.hit("a"))
+            self.assertTrue(limiter.hit("a"))
+            self.assertFalse(limiter.hit("a"))
+            self.assertTrue(limiter.hit("b"))
+        # A sixth of the previous window (3 hits) still counts
+        with mock.patch.object(ratelimit.time, "time", return_value=170.0):
+            self.assertTrue(limiter.hit("a"))
+            self.assertFalse(limiter.hit("a"))
+
+    def test_concurrent_hits(self):
+        limiter = ratelimit.SlidingWindowLimiter("test", limit=10, window=60)
+        allowed = []
+        barrier = threading.Barrier(30)
+
+        def hit():
+            barrier.wait()
+            allowed.append(limiter.hit("a"))
+
+        threads = [threading.Thread(target=hit) for _ in range(30)]
+        with mock.patch.object(ratelimit.time, "time", return_value=60.0):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(allowed.count(True), 10)
+
+    def test_expired_between_add_and_incr(self):
+        limiter = ratelimit.SlidingWindowLimiter("test", limit=2, window=60)
+        incr = cache.incr
+        expired = []
+
+        def expire_once(key, *args, **kwargs):
+            if expired:
+                return incr(key, *args, **kwargs)
+            # The key expires and a concurrent hit counts before this one
+            expired.append(key)
+            cache.set(key, 1)
+            raise ValueError(key)
+
+        with mock.patch.object(ratelimit.cache, "incr", side_effect=expire_once):
+            self.assertTrue(limiter.hit("a"))
+        self.assertFalse(limiter.hit("a"))
+
+    def test_client_ip(self):
+        request = RequestFactory().post(
+            "/", HTTP_X_FORWARDED_FOR="1.1.1.1, 2.2.2.2", REMOTE_ADDR="3.3.3.3"
+        )
+        self.assertEqual(ratelimit.get_client_ip(request), "3.3.3.3")
+        with override_settings(
+            AUTHENTICATOR={**settings.AUTHENTICATOR, "num_proxies": 1}
+        ):
+            self.assertEqual(ratelimit.get_client_ip(request), "2.2.2.2")
+
+    def test_overloaded(self):
+        release = threading.Event()
+        pool = hashing.HashingPool(max_workers=1, max_pending=1, timeout=5)
+        with mock.patch.object(hashing, "pool", pool):
+            future = pool._executor.submit(release.wait)
+            pool._admission.acquire()  # taken by a pending login
+            try:
+                self.assertEqual(self.login().status_code, 503)
+            finally:
+                pool._admission.release()
+                release.set()
+                future.result()
+            self.assertEqual(self.login().status_code, 200)
+
+    def test_timed_out_hash_keeps_admission(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        pool = hashing.HashingPool(max_workers=1, max_pending=1, timeout=0.05)
+        with self.assertRaises(hashing.Overloaded):
+            pool.run(release.wait)
+        # Still running, so the next one is not queued
+        queued = mock.Mock()
+        with self.assertRaises(hashing.Overloaded):
+            pool.run(queued)
+        release.set()
+        pool._executor.shutdown(wait=True)
+        queued.assert_not_called()
+        self.assertTrue(pool._admission.acquire(blocking=False))
+
+    def test_timed_out_hash_is_cancelled(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        pool = hashing.HashingPool(max_workers=1, max_pending=2, timeout=0.05)
+        with self.assertRaises(hashing.Overloaded):
+            pool.run(release.wait)
+        queued = mock.Mock()
+        with self.assertRaises(hashing.Overloaded):
+            pool.run(queued)
+        release.set()
+        pool._executor.shutdown(wait=True)
+        queued.assert_not_called()
+
+
+class DenylistTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        denylist.tokens.clear()
+        User.objects.create_user(username="user", password="password")
+
+    def login(self):
+        resp = self.client.post(
+            "/auth/token",
+            {"username": "user", "password": "password"},
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 200)
+        return resp.cookies["refresh-token"].value
+
+    def refresh(self, refresh_token):
+        self.client.cookies["refresh-token"] = refresh_token
+        return self.client.post("/auth/token/refresh")
+
+    def test_logout(self):
+        refresh_token = self.login()
+        other_token = self.login()
+        self.assertEqual(self.refresh(refresh_token).status_code, 200)
+
+        self.client.cookies["refresh-token"] = refresh_token
+        resp = self.client.post("/auth/logout")
+        self.assertEqual(resp.status_code, 204)
+        self.assertEqual(resp.cookies["refresh-token"].value, "")
+        self.assertEqual(self.refresh(refresh_token).status_code, 401)
+        self.assertEqual(self.refresh(other_token).status_code, 200)
+
+    def test_revoked_refresh_token_as_bearer(self):
+        refresh_token = self.login()
+        self.client.cookies["refresh-token"] = refresh_token
+        self.assertEqual(self.client.post("/auth/logout").status_code, 204)
+
+        resp = self.client.get(
+            "/users/me", HTTP_AUTHORIZATION=f"Bearer {refresh_token}"
+        )
+        self.assertEqual(resp.status_code, 401)
+
+    def test_token_types(self):
+        access_token, refresh_token = Authenticator().login(
+            User.objects.get(username="user")
+        )
+        resp = self.client.get(
+            "/users/me", HTTP_AUTHORIZATION=f"Bearer {refresh_token}"
+        )
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(self.refresh(access_token).status_code, 401)
+        self.assertEqual(self.refresh(refresh_token).status_code, 200)
+
+    def test_logout_everywhere(self):
+        tokens = [self.login(), self.login()]
+        self.refresh(tokens[0])
+        resp = self.client.post("/auth/logout?everywhere=true")
+        self.assertEqual(resp.status_code, 204)
+        for token in tokens:
+            self.assertEqual(self.refresh(token).status_code, 401)
+
+    def test_synced_to_other_processes(self):
+        refresh_token = self.login()
+        token = verifier.decode(refresh_token)
+        other = denylist.Denylist(refresh_interval=60)
+        self.assertFalse(other.is_revoked(token))
+
+        denylist.tokens.revoke(token)
+        # Not before the refresh interval
+        with self.assertNumQueries(0):
+            self.assertFalse(other.is_revoked(token))
+        other.refresh(force=True)
+        with self.assertNumQueries(0):
+            self.assertTrue(other.is_revoked(token))
+
+    def test_purge_expired(self):
+        token = verifier.decode(self.login())
+        denylist.tokens.revoke(token)
+        self.assertEqual(denylist.purge_expired(), 0)
+        models.RevokedToken.objects.update(expires_at=timezone.now())
+        self.assertEqual(denylist.purge_expired(), 1)
+
+
+def parse_server_timing(header: str) -> dict:
+    metrics = {}
+    for metric in header.split(", "):
+        name, *params = metric.split(";")
+        metrics[name] = dict(param.split("=", 1) for param in params)
+    return metrics
+
+
+@skipUnless(settings.AUTHENTICATOR["server_timing"], "Server-Timing is disabled")
+class ServerTimingTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.refresh_token = Authenticator().login(self.user)[1]
+
+    def test_header(self):
+        self.client.cookies["refresh-token"] = self.refresh_token
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.post("/auth/token/refresh")
+        self.assertEqual(resp.status_code, 200)
+        metrics = parse_server_timing(resp["Server-Timing"])
+        self.assertEqual(list(metrics), ["db", "auth", "view", "serialize", "total"])
+        self.assertEqual(metrics["db"]["desc"], f'"{len(queries)} queries"')
+        for metric in metrics.values():
+            self.assertGreaterEqual(float(metric["dur"]), 0)
+        self.assertGreater(float(metrics["auth"]["dur"]), 0)
+        self.assertGreaterEqual(
+            float(metrics["total"]["dur"]), float(metrics["view"]["dur"])
+        )
+
+    def test_async_view(self):
+        resp = self.client.post(
+            "/auth/token",
+            {"username": "user", "password": "password"},
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 200)
+        metrics = parse_server_timing(resp["Server-Timing"])
+        self.assertNotEqual(metrics["db"]["desc"], '"0 queries"')
+        self.assertGreater(float(metrics["view"]["dur"]), 0)
+
+    def test_log_slow_requests(self):
+        with self.assertLogs(middleware.logger, "DEBUG") as logs:
+            self.client.get("/required-items")
+        self.assertEqual(logs.records[0].levelname, "DEBUG")
+        self.assertIn("route=required-items", logs.output[0])
+
+        slow = {**settings.AUTHENTICATOR, "slow_request_ms": 0}
+        with override_settings(AUTHENTICATOR=slow):
+            with self.assertLogs(middleware.logger, "WARNING") as logs:
+                self.client.get("/required-items")
+        self.assertEqual(logs.records[0].levelname, "WARNING")
+
+    def test_measure_outside_requests(self):
+        with middleware.measure("auth"):
+            pass
+        self.assertIsNone(middleware._current.get())
@@ -1,4 +1,4 @@
-from functools import wraps
+from functools import lru_cache, wraps
 
 from django.conf import settings
 from django.contrib.auth.tokens import default_token_generator
@@ -8,18 +8,30 @@ from django.template.loader import render_to_string
 from hashids import Hashids
 from ninja import errors
 
+from . import outbox
+
 _hashids = Hashids(
     settings.AUTHENTICATOR["hash_id_secret"],
     min_length=settings.AUTHENTICATOR["min_length"],
 )
 
 
+# Both run on every authenticated request, and a user keeps the same id.
+# Only the valid ids are cached, the invalid ones raise.
+@lru_cache(maxsize=settings.AUTHENTICATOR["hash_id_cache_size"])
 def encode_id(id: int) -> str:
-    return _hashids.encode(id)
+    data = _hashids.encode(id)
+    if not data:
+        raise ValueError(f"Unable to encode id: {id!r}")
+    return data
 
 
+@lru_cache(maxsize=settings.AUTHENTICATOR["hash_id_cache_size"])
 def decode_id(data: str) -> int:
-    return _hashids.decode(data)[0]
+    ids = _hashids.decode(data)
+    if len(ids) != 1:
+        raise ValueError(f"Unable to decode id: {data!r}")
+    return ids[0]
 
 
 def is_verified_email_or_403(view_func):
@@ -50,4 +62,5 @@ def send_verification_email(request, user):
 
     msg = EmailMultiAlternatives(mail_title, text, to=[user.email])
     msg.attach_alternative(html, "text/html")
-    msg.send(fail_silently=False)
+    # Sent by the `send_queued_emails` worker
+    outbox.enqueue(msg)
@@ -0,0 +1,408 @@
+"""Latency and queries of every API route on seeded data
+
+Usage: python -m benchmarks.bench_api [--organizations N] [--donators N]
+                                      [--items N] [--donations N]
+                                      [--requests N] [--seed N]
+                                      [--output FILE] [--compare FILE]
+
+A test database is created and filled by `share.seed.seed`, so the runs on
+the same arguments see the same data and the development database is left
+alone. Every route is called `--requests` times with the test client, after
+a few warm-up calls; the objects a call consumes, e.g. the donation to
+approve, are prepared outside of the timing. The results are saved as JSON
+and `--compare` prints the changes from the results of another run, e.g. of
+the previous commit.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import time
+from collections import Counter
+from unittest import mock
+
+from benchmarks.utils import setup_django
+
+WARMUP = 3
+JSON = "application/json"
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Scenarios:
+    """The calls of the routes on the seeded `dataset`
+
+    Each `prepare(i)` creates what the i-th call needs and returns the call to
+    time, see `routes`.
+    """
+
+    def __init__(self, dataset, rng: random.Random):
+        from django.test import Client
+
+        from authenticator.api import Authenticator
+
+        self.rng = rng
+        self.authenticator = Authenticator()
+        self.organizations = dataset.organizations
+        self.org_users = [o.user for o in self.organizations]
+        self.donator_users = [d.user for d in dataset.donators]
+        self.org_clients = [self.client_of(user) for user in self.org_users]
+        self.donator_clients = [self.client_of(user) for user in self.donator_users]
+        self.collecting = [item for item in dataset.required_items if item.is_valid()]
+        self.anonymous = Client()
+
+    def routes(self) -> dict:
+        return {
+            "POST /registration/organization": self.register_organization,
+            "POST /registration/donator": self.register_donator,
+            "GET /required-items": self.list_required_items,
+            "GET /organization/required-items": self.list_organization_items,
+            "POST /organization/required-items": self.create_organization_item,
+            "DELETE /organization/required-items/{id}": self.delete_organization_item,
+            "PATCH /organization/donations/{id}": self.edit_organization_donation,
+            "POST /required-items/donations": self.create_donation,
+            "GET /donations": self.list_donations,
+            "PATCH /donations": self.edit_donation,
+            "GET /users/me (organization)": self.get_organization_me,
+            "GET /users/me (donator)": self.get_donator_me,
+            "POST /auth/token": self.create_jwt_token,
+            "POST /auth/token/refresh": self.refresh_jwt_token,
+            "POST /auth/logout": self.logout,
+            "GET /auth/verify-email": self.verify_email,
+            "GET /oauth/line/login": self.oauth_line_login,
+            "GET /oauth/line/callback": self.oauth_line_callback,
+        }
+
+    def client_of(self, user):
+        from django.test import Client
+
+        access_token = self.authenticator.login(user)[0]
+        return Client(HTTP_AUTHORIZATION=f"Bearer {access_token}")
+
+    def pending_donation(self, item, user):
+        from share import models
+
+        return models.Donation.objects.create(
+            required_item=item, amount=1, created_by=user
+        )
+
+    def register_organization(self, i):
+        from share import choices
+
+        payload = {
+            "username": f"bench-org-{i}",
+            "password": "a-long-password",
+            "confirmed_password": "a-long-password",
+            "email": f"bench-org-{i}@example.com",
+            "name": f"bench organization {i}",
+            "type": choices.OrganizationTypes.hospital,
+            "type_other": "",
+            "city": self.rng.choice(choices.Cities.values),
+            "address": "address",
+            "phone": "0212345678",
+            "office_hours": "",
+            "other_contact_method": choices.ContactMethods.not_set,
+            "other_contact": "",
+        }
+        return lambda: self.anonymous.post(
+            "/registration/organization", payload, content_type=JSON
+        )
+
+    def register_donator(self, i):
+        from django.contrib.auth import get_user_model
+
+        from share import choices
+
+        user = get_user_model().objects.create(username=f"bench-donator-{i}")
+        client = self.client_of(user)
+        payload = {
+            "email": f"bench-donator-{i}@example.com",
+            "phone": "0912345678",
+            "other_contact_method": choices.ContactMethods.line,
+            "other_contact": "line",
+        }
+        return lambda: client.post("/registration/donator", payload, content_type=JSON)
+
+    def list_required_items(self, i):
+        from share import choices
+
+        # Every other call is filtered by a city
+        if i % 2 == 0:
+            return lambda: self.anonymous.get("/required-items")
+        city = self.rng.choice(choices.Cities.values)
+        return lambda: self.anonymous.get(f"/required-items?city={city}")
+
+    def list_organization_items(self, i):
+        client = self.org_clients[i % len(self.org_clients)]
+        return lambda: client.get("/organization/required-items")
+
+    def create_organization_item(self, i):
+        client = self.org_clients[i % len(self.org_clients)]
+        payload = {
+            "name": f"bench item {i}",
+            "amount": 100,
+            "unit": "piece",
+            "ended_date": str(datetime.date.today() + datetime.timedelta(days=7)),
+        }
+        return lambda: client.post(
+            "/organization/required-items", payload, content_type=JSON
+        )
+
+    def delete_organization_item(self, i):
+        from share import models
+
+        index = i % len(self.organizations)
+        item = models.RequiredItem.objects.create(
+            organization=self.organizations[index],
+            name=f"bench item {i}",
+            amount=100,
+            unit="piece",
+            ended_date=datetime.date.today() + datetime.timedelta(days=7),
+        )
+        self.pending_donation(item, self.rng.choice(self.donator_users))
+        client = self.org_clients[index]
+        return lambda: client.delete(f"/organization/required-items/{item.id}")
+
+    def edit_organization_donation(self, i):
+        from share import states
+
+        item = self.rng.choice(self.collecting)
+        donation = self.pending_donation(item, self.rng.choice(self.donator_users))
+        client = self.org_clients[self.org_users.index(item.organization.user)]
+        payload = {"event": states.DonationApprovedEvent.event_id()}
+        return lambda: client.patch(
+            f"/organization/donations/{donation.id}", payload, content_type=JSON
+        )
+
+    def create_donation(self, i):
+        client = self.donator_clients[i % len(self.donator_clients)]
+        payload = [
+            {"id": item.id, "amount": 1, "excepted_delivery_date": None}
+            for item in self.rng.sample(self.collecting, min(3, len(self.collecting)))
+        ]
+        return lambda: client.post(
+            "/required-items/donations", payload, content_type=JSON
+        )
+
+    def list_donations(self, i):
+        client = self.donator_clients[i % len(self.donator_clients)]
+        return lambda: client.get("/donations")
+
+    def edit_donation(self, i):
+        from share import states
+
+        index = i % len(self.donator_users)
+        donation = self.pending_donation(
+            self.rng.choice(self.collecting), self.donator_users[index]
+        )
+        client = self.donator_clients[index]
+        payload = [
+            {"id": donation.id, "event": states.DonationCancelledEvent.event_id()}
+        ]
+        return lambda: client.patch("/donations", payload, content_type=JSON)
+
+    def get_organization_me(self, i):
+        client = self.org_clients[i % len(self.org_clients)]
+        return lambda: client.get("/users/me")
+
+    def get_donator_me(self, i):
+        client = self.donator_clients[i % len(self.donator_clients)]
+        return lambda: client.get("/users/me")
+
+    def create_jwt_token(self, i):
+        from share import seed
+
+        users = self.org_users + self.donator_users
+        payload = {
+            "username": users[i % len(users)].username,
+            "password": seed.PASSWORD,
+        }
+        # One address per call, the limits of the addresses are not the point
+        address = f"10.0.{i // 256 % 256}.{i % 256}"
+        return lambda: self.anonymous.post(
+            "/auth/token", payload, content_type=JSON, REMOTE_ADDR=address
+        )
+
+    def with_refresh_token(self, i):
+        from django.test import Client
+
+        client = Client()
+        user = self.org_users[i % len(self.org_users)]
+        client.cookies["refresh-token"] = self.authenticator.login(user)[1]
+        return client
+
+    def refresh_jwt_token(self, i):
+        client = self.with_refresh_token(i)
+        return lambda: client.post("/auth/token/refresh")
+
+    def logout(self, i):
+        client = self.with_refresh_token(i)
+        return lambda: client.post("/auth/logout")
+
+    def verify_email(self, i):
+        from django.contrib.auth import get_user_model
+        from django.contrib.auth.tokens import default_token_generator
+
+        from authenticator import utils
+
+        user = get_user_model().objects.create(
+            username=f"bench-inactive-{i}", is_active=False
+        )
+        uid = utils.encode_id(user.id)
+        token = default_token_generator.make_token(user)
+        return lambda: self.anonymous.get(f"/auth/verify-email?uid={uid}&token={token}")
+
+    def oauth_line_login(self, i):
+        return lambda: self.anonymous.get("/oauth/line/login?next=/")
+
+    def oauth_line_callback(self, i):
+        from django.test import Client
+
+        client = Client()
+        client.cookies["line_oauth_state"] = "state"
+        client.cookies["next"] = "/"
+
+        return lambda: client.get("/oauth/line/callback?code=code&state=state")
+
+
+def measure(prepare, requests: int) -> dict:
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    latencies = []
+    queries = []
+    statuses = Counter()
+    for i in range(WARMUP + requests):
+        call = prepare(i)
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            resp = call()
+            seconds = time.perf_counter() - start
+        if i < WARMUP:
+            continue
+        latencies.append(seconds)
+        queries.append(len(captured))
+        statuses[resp.status_code] += 1
+
+    # The 99 cut points of the percentiles
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": requests,
+        "p50_ms": round(cuts[49] * 1e3, 3),
+        "p95_ms": round(cuts[94] * 1e3, 3),
+        "p99_ms": round(cuts[98] * 1e3, 3),
+        "queries": round(statistics.mean(queries), 2),
+        "max_queries": max(queries),
+        "statuses": {str(status): n for status, n in sorted(statuses.items())},
+    }
+
+
+def compare(results: dict, previous: dict):
+    print(f"\nchanges from {previous['commit']}")
+    for route, result in results["routes"].items():
+        before = previous["routes"].get(route)
+        if before is None:
+            continue
+        changes = [
+            f"{key} {(result[key] / before[key] - 1) * 100:+7.1f}%"
+            for key in ("p50_ms", "p95_ms", "p99_ms")
+            if before[key]
+        ]
+        print(
+            f"{route:<42} {'  '.join(changes)}  "
+            f"queries {result['queries'] - before['queries']:+.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--organizations", type=int, default=44)
+    parser.add_argument("--donators", type=int, default=50)
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--donations", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="default: benchmarks/results/COMMIT.json")
+    parser.add_argument("--compare", help="the JSON results of another run")
+    args = parser.parse_args()
+
+    setup_django()
+    # The timing and the warnings of the requests are not the output
+    logging.disable(logging.WARNING)
+
+    from django.conf import settings
+    from django.core.cache import cache
+    from django.test.utils import setup_databases, teardown_databases
+
+    from benchmarks.stub_line import StubLineServer
+    from oauth2 import line
+    from share import seed
+
+    commit = git_commit()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        cache.clear()
+        start = time.perf_counter()
+        dataset = seed.seed(
+            organizations=args.organizations,
+            donators=args.donators,
+            required_items=args.items,
+            donations=args.donations,
+            random_seed=args.seed,
+        )
+        print(
+            f"seeded {args.organizations} organizations, {args.items} items and "
+            f"{args.donations} donations in {time.perf_counter() - start:.1f}s"
+        )
+
+        rng = random.Random(args.seed)
+        routes = {}
+        with StubLineServer() as stub, mock.patch.object(
+            line, "client", line.create_client(line_api_url=stub.url)
+        ):
+            for route, prepare in Scenarios(dataset, rng).routes().items():
+                result = routes[route] = measure(prepare, args.requests)
+                print(
+                    f"{route:<42} p50 {result['p50_ms']:8.2f} ms  "
+                    f"p95 {result['p95_ms']:8.2f} ms  "
+                    f"p99 {result['p99_ms']:8.2f} ms  "
+                    f"{result['queries']:6.2f} queries  {result['statuses']}"
+                )
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+    results = {
+        "commit": commit,
+        # The cache backend decides the queries of the cached routes
+        "cache": settings.CACHES["default"]["BACKEND"],
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "args": vars(args),
+        "routes": routes,
+    }
+    output = args.output or os.path.join("benchmarks", "results", f"{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
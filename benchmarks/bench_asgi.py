@@ -0,0 +1,195 @@
+"""Compare the throughput of the WSGI and the ASGI setups
+
+Usage: python -m benchmarks.bench_asgi [--workers N] [--concurrency N]
+                                       [--duration SECONDS] [--delay SECONDS]
+
+Both setups are started with gunicorn against the development database, with
+the same number of workers. The LINE API of the login callback is a local stub
+which answers after `--delay` seconds; the callback creates the stub user in
+the database once. The authenticated routes are called as an organization and
+a donator of the development database, the required items created by the
+write route are deleted after each setup.
+
+Django 3.2 runs all the sync views and `sync_to_async` calls of an ASGI worker
+on its one thread, so the sync and the write routes show what is lost there.
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.utils import setup_django
+
+SETUPS = {
+    "wsgi": ["api.wsgi", "-k", "gthread", "--threads", "4"],
+    "asgi": ["api.asgi:application", "-k", "uvicorn.workers.UvicornWorker"],
+}
+# The method, the path and the user of each route, the user's token goes to
+# the Authorization header.
+ENDPOINTS = {
+    "GET /required-items": ("GET", "/required-items", None),
+    "GET /oauth/line/callback": (
+        "GET",
+        "/oauth/line/callback?code=code&state=state",
+        None,
+    ),
+    "GET /organization/required-items": (
+        "GET",
+        "/organization/required-items",
+        "organization",
+    ),
+    "POST /organization/required-items": (
+        "POST",
+        "/organization/required-items",
+        "organization",
+    ),
+    "GET /donations": ("GET", "/donations", "donator"),
+    "GET /users/me": ("GET", "/users/me", "donator"),
+}
+COOKIES = {
+    "GET /oauth/line/callback": {"line_oauth_state": "state", "next": "/"},
+}
+
+
+def bench_users() -> dict:
+    """The organization and the donator users of the authenticated routes"""
+    from django.contrib.auth import get_user_model
+
+    from share import choices, models
+
+    User = get_user_model()
+    organization, _ = User.objects.get_or_create(username="bench-asgi-org")
+    models.Organization.objects.get_or_create(
+        user=organization,
+        defaults=dict(
+            name="bench organization",
+            type=choices.OrganizationTypes.hospital,
+            city=choices.Cities.TPE,
+            address="address",
+            phone="0212345678",
+            other_contact_method=choices.ContactMethods.not_set,
+        ),
+    )
+    donator, _ = User.objects.get_or_create(username="bench-asgi-donator")
+    models.Donator.objects.get_or_create(
+        user=donator,
+        defaults=dict(
+            phone="0912345678", other_contact_method=choices.ContactMethods.not_set
+        ),
+    )
+    return {"organization": organization, "donator": donator}
+
+
+def start_server(setup: str, port: int, workers: int, env: dict) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", *SETUPS[setup]]
+        + ["-b", f"127.0.0.1:{port}", "-w", str(workers), "--log-level", "warning"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/docs")
+            return proc
+        except httpx.TransportError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError(f"{setup} server did not start")
+
+
+async def load(
+    method: str,
+    url: str,
+    concurrency: int,
+    duration: float,
+    cookies: dict,
+    headers: dict,
+    json=None,
+):
+    done = errors = 0
+    deadline = time.monotonic() + duration
+    # A client per connection, so the server sees `concurrency` connections
+    clients = [
+        httpx.AsyncClient(cookies=cookies, headers=headers, timeout=30)
+        for _ in range(concurrency)
+    ]
+
+    async def run(client: httpx.AsyncClient):
+        nonlocal done, errors
+        while time.monotonic() < deadline:
+            try:
+                resp = await client.request(method, url, json=json)
+            except httpx.TransportError:  # e.g. a recycled worker
+                errors += 1
+            else:
+                errors += resp.status_code >= 400
+            done += 1
+
+    start = time.monotonic()
+    await asyncio.gather(*[run(c) for c in clients])
+    seconds = time.monotonic() - start
+    for client in clients:
+        await client.aclose()
+    return done / seconds, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--delay", type=float, default=0.1)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from authenticator.api import Authenticator
+    from benchmarks.stub_line import StubLineServer
+    from share import models
+
+    users = bench_users()
+    tokens = {name: Authenticator().login(user)[0] for name, user in users.items()}
+    item = {
+        "name": "bench item",
+        "amount": 100,
+        "unit": "piece",
+        "ended_date": str(datetime.date.today() + datetime.timedelta(days=7)),
+    }
+
+    with StubLineServer(delay=args.delay) as stub:
+        env = {**os.environ, "LINE_API_URL": stub.url}
+        for setup in SETUPS:
+            proc = start_server(setup, args.port, args.workers, env)
+            try:
+                for name, (method, path, user) in ENDPOINTS.items():
+                    headers = {}
+                    if user:
+                        headers["Authorization"] = f"Bearer {tokens[user]}"
+                    rps, errors = asyncio.run(
+                        load(
+                            method,
+                            f"http://127.0.0.1:{args.port}{path}",
+                            args.concurrency,
+                            args.duration,
+                            COOKIES.get(name, {}),
+                            headers,
+                            item if method == "POST" else None,
+                        )
+                    )
+                    print(f"{setup} {name:<36} {rps:10.1f} req/s {errors:6d} errors")
+            finally:
+                proc.terminate()
+                proc.wait()
+                models.RequiredItem.objects.filter(
+                    organization__user=users["organization"]
+                ).delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Measure the overhead of the token handling on the request path
+
+Usage: python -m benchmarks.bench_auth [--number N]
+
+The benchmark creates a user in a transaction which is rolled back at the end,
+so it can run against the development database.
+"""
+import argparse
+
+from benchmarks.utils import per_call, report, rollback, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=1000)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.contrib.auth import get_user_model
+    from django.test import Client
+    from fastapi_jwt_auth import AuthJWT
+
+    from authenticator import utils
+    from authenticator.api import Authenticator, verifier
+    from authenticator.principals import principals
+
+    User = get_user_model()
+    number = args.number
+
+    with rollback():
+        user = User.objects.create_user(username="_bench", password="_bench-password")
+        authenticator = Authenticator()
+        access_token, _ = authenticator.login(user)
+
+        subject = utils.encode_id(user.id)
+        report(
+            "encode_id (Hashids)",
+            per_call(lambda: utils._hashids.encode(user.id), number),
+        )
+        report(
+            "encode_id (memoized)", per_call(lambda: utils.encode_id(user.id), number)
+        )
+        report(
+            "decode_id (Hashids)",
+            per_call(lambda: utils._hashids.decode(subject), number),
+        )
+        report(
+            "decode_id (memoized)", per_call(lambda: utils.decode_id(subject), number)
+        )
+        report(
+            "decode (AuthJWT per call)",
+            per_call(lambda: AuthJWT().get_raw_jwt(access_token), number),
+        )
+        report(
+            "decode (JWTVerifier)",
+            per_call(lambda: verifier.decode(access_token), number),
+        )
+        report(
+            "create tokens",
+            per_call(
+                lambda: (
+                    authenticator.auth.create_access_token(subject="sub"),
+                    authenticator.auth.create_refresh_token(subject="sub"),
+                ),
+                number,
+            ),
+        )
+
+        def authenticate_uncached():
+            principals.clear()
+            authenticator.authenticate_by_token(access_token)
+
+        report(
+            "authenticate_by_token (uncached)", per_call(authenticate_uncached, number)
+        )
+        report(
+            "authenticate_by_token (cached)",
+            per_call(lambda: authenticator.authenticate_by_token(access_token), number),
+        )
+        report("login", per_call(lambda: authenticator.login(user), number))
+
+        client = Client()
+        payload = {"username": "_bench", "password": "_bench-password"}
+        # PBKDF2 dominates, fewer runs are enough
+        report(
+            "POST /auth/token",
+            per_call(
+                lambda: client.post(
+                    "/auth/token", payload, content_type="application/json"
+                ),
+                max(number // 100, 1),
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Compare the latency of the hot queries with and without the pooled mode
+
+Usage: python -m benchmarks.bench_db [--threads N] [--requests N]
+
+Each thread plays the requests of a worker: the connection handling of the
+request boundaries, the principal lookup, a donation by id and a page of the
+required items. The modes are the database settings of `api.db`. The data is
+created in the development database and deleted at the end.
+"""
+import argparse
+import statistics
+import threading
+import time
+from datetime import date, timedelta
+
+from benchmarks.utils import setup_django
+
+MODES = {
+    "connection per request": {
+        "CONN_MAX_AGE": 0,
+        "CONN_HEALTH_CHECKS": False,
+        "PREPARE_THRESHOLD": None,
+    },
+    "persistent + health checks": {
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
+        "PREPARE_THRESHOLD": None,
+    },
+    "persistent + prepared": {
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
+        "PREPARE_THRESHOLD": 5,
+    },
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--items", type=int, default=200)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.contrib.auth import get_user_model
+    from django.db import close_old_connections, connections
+
+    from share import choices, models
+
+    User = get_user_model()
+
+    user = User.objects.create_user(username="_bench_db")
+    try:
+        organization = models.Organization.objects.create(
+            name="_bench_db",
+            user=user,
+            type=choices.OrganizationTypes.hospital,
+            city=choices.Cities.TPE,
+        )
+        items = models.RequiredItem.objects.bulk_create(
+            [
+                models.RequiredItem(
+                    organization=organization,
+                    name=f"item {i}",
+                    amount=100,
+                    unit=choices.Units.piece,
+                    ended_date=date.today() + timedelta(days=i % 30),
+                )
+                for i in range(args.items)
+            ]
+        )
+        donation = models.Donation.objects.create(
+            required_item=items[0], amount=1, created_by=user
+        )
+        connections.close_all()
+
+        def request():
+            close_old_connections()  # request_started
+            User.objects.select_related("organization").get(id=user.id)
+            models.Donation.objects.select_related("required_item").get(id=donation.id)
+            list(
+                models.RequiredItem.objects.select_related("organization")
+                .filter(ended_date__gte=date.today(), organization__city="TPE")
+                .order_by("organization_id", "-ended_date", "-id")[:21]
+            )
+            close_old_connections()  # request_finished
+
+        for name, options in MODES.items():
+            connections.settings["default"].update(options)
+            latencies = []
+
+            def worker():
+                for _ in range(args.requests):
+                    start = time.perf_counter()
+                    request()
+                    latencies.append(time.perf_counter() - start)
+                connections.close_all()
+
+            threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            seconds = time.perf_counter() - start
+
+            latencies.sort()
+            p95 = latencies[int(len(latencies) * 0.95)]
+            print(
+                f"{name:<28} p50 {statistics.median(latencies) * 1e3:7.2f} ms  "
+                f"p95 {p95 * 1e3:7.2f} ms  {len(latencies) / seconds:8.1f} req/s"
+            )
+    finally:
+        user.delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Measure the startup time and the memory of the gunicorn workers
+
+Usage: python -m benchmarks.bench_gunicorn [--workers N]
+
+gunicorn is started with gunicorn.conf.py with and without preload_app. The
+startup time is until the first response, the memory is read from /proc
+(Linux only) after every worker has served a few requests. USS is the memory
+of the worker alone, PSS adds its share of the pages shared with the others.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def read_memory(pid: int) -> tuple:
+    """Return (USS, PSS) in KiB"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return values["Private_Clean"] + values["Private_Dirty"], values["Pss"]
+
+
+def children(pid: int) -> list:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(p) for p in f.read().split()]
+
+
+def measure(preload: bool, workers: int, port: int):
+    env = {
+        **os.environ,
+        "PORT": str(port),
+        "WEB_CONCURRENCY": str(workers),
+        "GUNICORN_PRELOAD": "1" if preload else "0",
+    }
+    start = time.monotonic()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--access-logfile", "/dev/null"],
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            try:
+                httpx.get(f"http://127.0.0.1:{port}/docs")
+                break
+            except httpx.TransportError:
+                if proc.poll() is not None:
+                    raise RuntimeError("gunicorn exited")
+                time.sleep(0.01)
+        startup = time.monotonic() - start
+
+        while len(children(proc.pid)) < workers:
+            time.sleep(0.1)
+        for _ in range(workers * 20):
+            httpx.get(f"http://127.0.0.1:{port}/required-items")
+
+        memory = [read_memory(pid) for pid in children(proc.pid)]
+        uss = sum(m[0] for m in memory) / len(memory)
+        pss = sum(m[1] for m in memory) / len(memory)
+        print(
+            f"preload={preload!s:<5} startup {startup:6.2f}s  "
+            f"USS {uss / 1024:6.1f} MiB  PSS {pss / 1024:6.1f} MiB per worker"
+        )
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    for preload in (False, True):
+        measure(preload, args.workers, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Measure the LINE API calls of the login callback against a local stub
+
+Usage: python -m benchmarks.bench_line [--number N] [--delay SECONDS]
+
+Each call exchanges the code for a token and fetches the profile, the stub
+answers every request after `--delay` seconds. The sync calls are what a sync
+worker did per login, the async calls run `--number` logins concurrently on
+one event loop with the pooled client.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.utils import report, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.05)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from requests_oauthlib import OAuth2Session
+
+    from benchmarks.stub_line import StubLineServer
+    from oauth2 import line
+
+    number = args.number
+
+    with StubLineServer(delay=args.delay) as stub:
+
+        def sync_login():
+            session = OAuth2Session("client-id", state="state", redirect_uri=stub.url)
+            session.fetch_token(
+                f"{stub.url}/oauth2/v2.1/token",
+                code="code",
+                client_secret="secret",
+                include_client_id=True,
+            )
+            session.get(f"{stub.url}/v2/profile").json()
+
+        start = time.perf_counter()
+        for _ in range(number):
+            sync_login()
+        report("sync, fresh session", (time.perf_counter() - start) / number)
+
+        stub.connections = 0
+        client = line.create_client(line_api_url=stub.url)
+
+        async def async_login():
+            token = await client.fetch_token("code", redirect_uri=stub.url)
+            await client.get_profile(token["access_token"])
+
+        async def run():
+            await async_login()  # warm up the pool
+            start = time.perf_counter()
+            await asyncio.gather(*[async_login() for _ in range(number)])
+            seconds = time.perf_counter() - start
+            await client.aclose()
+            return seconds
+
+        report("async, pooled, concurrent", asyncio.run(run()) / number)
+        print(f"{stub.connections} connections for {number + 1} async logins")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Compare the incremental donation state transition with the full replay
+
+Usage: python -m benchmarks.bench_states [--events N] [--number N]
+"""
+import argparse
+import timeit
+
+from share import states
+
+
+def replay_by_objects(raw_events, state_id: str) -> str:
+    # The way `Donation.calc_state` worked before the transition table
+    current_state = states.get_state(state_id)
+    for raw_event in raw_events:
+        current_state = current_state.apply(states.get_event(raw_event))
+    return current_state.state_id()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=3, help="length of histories")
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    history = [
+        states.DonationApprovedEvent().dict(),
+        states.DonationDispatchedEvent().dict(),
+    ]
+    # Pad the history with the events which are replayed into InvalidState
+    history += [states.DonationDeliveredEvent().dict()] * max(args.events - 2, 0)
+    names = [e["name"] for e in history]
+    last_state = states.replay(names[:-1])
+
+    cases = {
+        "replay (objects)": lambda: replay_by_objects(
+            history, states.PendingApprovalState.state_id()
+        ),
+        "replay (table)": lambda: states.replay(names),
+        "incremental (table)": lambda: states.transition(last_state, names[-1]),
+    }
+    print(f"{args.events} event(s) per donation, {args.number} runs")
+    for name, func in cases.items():
+        seconds = min(timeit.repeat(func, number=args.number, repeat=3))
+        print(f"{name:<20} {seconds / args.number * 1e6:10.3f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Local stand-in of the LINE API for the tests and the benchmarks
+
+    with StubLineServer(delay=0.1) as stub:
+        client = line.create_client(line_api_url=stub.url)
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROFILE = {
+    "userId": "U4af4980629",
+    "displayName": "Brown",
+    "pictureUrl": "https://profile.line-scdn.net/abcdefghijklmn",
+}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The client gave up, e.g. timed out
+        pass
+
+
+class StubLineServer:
+    def __init__(self, delay: float = 0, status: int = 200, profile: dict = PROFILE):
+        self.delay = delay
+        self.status = status
+        self.profile = profile
+        self.requests = 0
+        self.connections = 0
+        self._server = _Server(("127.0.0.1", 0), self._handler_class())
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, to observe the connection pooling of the clients
+            protocol_version = "HTTP/1.1"
+            # Don't add the delayed ACKs to the measured latency
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                stub.connections += 1
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path == "/oauth2/v2.1/token":
+                    self._respond(
+                        {
+                            "access_token": "stub-access-token",
+                            "token_type": "Bearer",
+                            "expires_in": 2592000,
+                            "scope": "profile",
+                        }
+                    )
+                else:
+                    self._respond({}, status=404)
+
+            def do_GET(self):
+                if self.path == "/v2/profile":
+                    self._respond(stub.profile)
+                else:
+                    self._respond({}, status=404)
+
+            def _respond(self, data: dict, status: int = None):
+                stub.requests += 1
+                time.sleep(stub.delay)
+                body = json.dumps(data).encode()
+                self.send_response(status or stub.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubLineServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,41 @@
+import contextlib
+import os
+import timeit
+import typing
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "api.settings")
+
+    import django
+    from django.test.utils import setup_test_environment
+
+    django.setup()
+    # Allow the test client and keep the emails in memory
+    setup_test_environment()
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def rollback():
+    """Run the benchmark in a transaction which is rolled back at the end"""
+    from django.db import transaction
+
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback()
+    except Rollback:
+        pass
+
+
+def per_call(func: typing.Callable[[], typing.Any], number: int) -> float:
+    """Return the best seconds per call of 3 runs"""
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def report(name: str, seconds: float):
+    print(f"{name:<36} {seconds * 1e6:12.1f} us/call")
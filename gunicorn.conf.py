@@ -0,0 +1,82 @@
+"""Gunicorn settings, loaded from the working directory
+
+Every setting can be overridden in the environment, e.g. Heroku sets
+WEB_CONCURRENCY from the memory of the dyno.
+"""
+import gc
+import os
+import tempfile
+import time
+
+# The uvicorn worker (GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker) is
+# opt-in. Django 3.2 runs all the sync views of an ASGI worker on one thread,
+# only the views waiting on the network gain, see benchmarks/bench_asgi.py.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+_is_async = worker_class.startswith("uvicorn")
+# The sync workers speak WSGI, an ASGI app would fail every request
+wsgi_app = "api.asgi:application" if _is_async else "api.wsgi:application"
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+_cpus = os.cpu_count() or 1
+# The threads of a worker wait on the database in turn. Mind max_connections
+# of the database: workers * threads.
+workers = int(os.getenv("WEB_CONCURRENCY", _cpus * 2 + 1))
+# For the sync workers only, gunicorn turns them into gthread if threads > 1
+threads = int(os.getenv("GUNICORN_THREADS", "1" if _is_async else "4"))
+
+# Import Django once in the master, the workers share the pages copy-on-write
+# and boot without importing it again.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+# Recycle the workers against slow leaks, with a jitter so that they don't
+# restart at the same time.
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+# The workers write their metrics to the files of this directory and /metrics
+# of any worker reads all of them, see api.metrics. It must be set before the
+# app imports prometheus_client; a new directory drops the files of the
+# previous run.
+if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="metrics-")
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+
+
+def when_ready(server):
+    cfg = server.cfg
+    if cfg.preload_app:
+        # Nothing is expected to connect during the import, but a connection of
+        # the master must not be shared by the forked workers.
+        from django.db import connections
+
+        connections.close_all()
+        # Keep the GC off the imported objects, which would copy their pages
+        gc.freeze()
+    server.log.info(
+        "Ready: %d %s workers x %d threads, preload=%s",
+        cfg.workers,
+        cfg.worker_class_str,
+        cfg.threads,
+        cfg.preload_app,
+    )
+
+
+def pre_fork(server, worker):
+    worker.boot_started_at = time.monotonic()
+
+
+def post_worker_init(worker):
+    worker.log.info(
+        "Worker %s booted in %.3fs",
+        worker.pid,
+        time.monotonic() - worker.boot_started_at,
+    )
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,23 +1,25 @@
 import logging
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.sites.shortcuts import get_current_site
-from django.http import HttpResponseBadRequest, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
 from django.urls import reverse
 from ninja import Router
 from requests_oauthlib import OAuth2Session
 
 from authenticator.api import Authenticator
 from authenticator.schemas import JWTToken
-from oauth2 import models
+from oauth2 import line, models
 
 LINE_CLIENT_ID = settings.SHARED_TW_SETTINGS["line_client_id"]
 LINE_CLIENT_SECRET = settings.SHARED_TW_SETTINGS["line_client_secret"]
 
 logger = logging.getLogger(__name__)
-authorization_base_url = "https://access.line.me/oauth2/v2.1/authorize"
-token_url = "https://api.line.me/oauth2/v2.1/token"
+authorization_base_url = (
+    f'{settings.SHARED_TW_SETTINGS["line_access_url"]}/oauth2/v2.1/authorize'
+)
 router = Router(tags=["OAuth"])
 User = get_user_model()
 
@@ -41,55 +43,54 @@ def oauth_line_login(request, next: str):
     return resp
 
 
-@router.get("/line/callback", url_name="line-login-callback", include_in_schema=False)
-def get(request, code: str, state: str):
+def _login(request, profile: dict):
     site = get_current_site(request)
+    url = f'{request.scheme}://{site.domain}{request.COOKIES["next"]}'
+
+    user, created = User.objects.get_or_create(username=profile["userId"])
+    if created:
+        user.last_name = profile["displayName"]
+        user.is_active = False
+        user.save()
+        models.Profile.objects.create(
+            user=user,
+            line_id=profile["userId"],
+            display_name=profile["displayName"],
+            picture_url=profile["pictureUrl"],
+        )
+
+    authenticator = Authenticator()
+    # TODO: use audience to control or one-time token?
+    access_token, refresh_token = authenticator.login(user)
+    url += f"?token={access_token}"
+    return authenticator.generate_http_response(
+        request,
+        HttpResponseRedirect,
+        refresh_token,
+        resp_kwargs=dict(redirect_to=url, content=""),
+        unpack_resp_kwargs=True,
+    )
+
+
+@router.get("/line/callback", url_name="line-login-callback", include_in_schema=False)
+async def get(request, code: str, state: str):
+    # Async so that the waits on the LINE API don't hold a worker
     try:
         if request.COOKIES["line_oauth_state"] != state:
             raise ValueError("line_oauth_state != state!?")
 
-        line = OAuth2Session(
-            LINE_CLIENT_ID,
-            state=state,
+        token = await line.client.fetch_token(
+            code,
             redirect_uri=request.build_absolute_uri(
                 reverse("api-0.1.0:line-login-callback")
             ),
         )
-        line.fetch_token(
-            token_url,
-            client_secret=LINE_CLIENT_SECRET,
-            authorization_response=request.build_absolute_uri(),
-        )
-        url = f'{request.scheme}://{site.domain}{request.COOKIES["next"]}'
-
-        profile = line.get("https://api.line.me/v2/profile").json()
-        user, created = User.objects.get_or_create(username=profile["userId"])
-        if created:
-            user.last_name = profile["displayName"]
-            user.is_active = False
-            user.save()
-            models.Profile.objects.create(
-                user=user,
-                line_id=profile["userId"],
-                display_name=profile["displayName"],
-                picture_url=profile["pictureUrl"],
-            )
-
-        authenticator = Authenticator()
-        # TODO: use audience to control or one-time token?
-        access_token, refresh_token = authenticator.login(user)
-        token = authenticator.generate_one_time_token(user)
-        url += f"?token={access_token}"
-        # FIXME: remove
-        print("oauth:", access_token)
-        return authenticator.generate_http_response(
-            request,
-            HttpResponseRedirect,
-            refresh_token,
-            resp_kwargs=dict(redirect_to=url, content=""),
-            unpack_resp_kwargs=True,
-        )
+        profile = await line.client.get_profile(token["access_token"])
+        return await sync_to_async(_login)(request, profile)
 
+    except line.Unavailable as e:
+        logger.warning("LINE API is unavailable: %s", e)
+        return HttpResponse("LINE is unavailable, please try later.", status=503)
     except Exception as e:
         logger.warning("Line auth callback failed: %s", e)
         return HttpResponseBadRequest("Invalid request")
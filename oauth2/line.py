@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import threading
+import time
+import typing
+import weakref
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Unavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Fail fast while the LINE API keeps failing
+
+    After `threshold` consecutive failures the circuit opens and the calls fail
+    with `Unavailable` without touching the network. After `reset_timeout`
+    seconds one call is let through; its success closes the circuit again.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: typing.Optional[float] = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise Unavailable("LINE API circuit is open")
+            # Half-open: let this call through and hold back the others
+            self.opened_at = time.monotonic()
+
+    def succeeded(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning("Open LINE API circuit, %d failures", self.failures)
+                self.opened_at = time.monotonic()
+
+
+class LineClient:
+    """Async client of the LINE login API
+
+    The connections are pooled per event loop, i.e. per process with ASGI.
+    Under WSGI every request runs in its own event loop and gets a fresh pool,
+    which is closed with the loop.
+    """
+
+    def __init__(
+        self,
+        *,
+        api_url: str,
+        client_id: str,
+        client_secret: str,
+        timeout: httpx.Timeout,
+        limits: httpx.Limits,
+        breaker: CircuitBreaker,
+    ):
+        self.api_url = api_url.rstrip("/")
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.timeout = timeout
+        self.limits = limits
+        self.breaker = breaker
+        # event loop -> (the generator of `_session()`, httpx.AsyncClient)
+        self._clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    async def _session(self) -> typing.AsyncIterator[httpx.AsyncClient]:
+        # An async generator, so that the loop closes the client when it shuts
+        # down its async generators, e.g. at the end of asyncio.run() which
+        # async_to_sync runs the async views of WSGI in.
+        client = httpx.AsyncClient(
+            base_url=self.api_url, timeout=self.timeout, limits=self.limits
+        )
+        try:
+            yield client
+        finally:
+            await client.aclose()
+
+    async def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        entry = self._clients.get(loop)
+        if entry is None:
+            session = self._session()
+            entry = self._clients[loop] = (session, await session.__anext__())
+        return entry[1]
+
+    async def _request(self, method: str, url: str, **kwargs) -> dict:
+        self.breaker.before_call()
+        try:
+            client = await self._client()
+            resp = await client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            self.breaker.failed()
+            raise Unavailable(f"{method} {url}: {e!r}") from e
+        if resp.status_code >= 500:
+            self.breaker.failed()
+            raise Unavailable(f"{method} {url}: {resp.status_code}")
+
+        self.breaker.succeeded()
+        # 4xx is our (or the user's) fault, e.g. an expired code
+        resp.raise_for_status()
+        return resp.json()
+
+    async def fetch_token(self, code: str, redirect_uri: str) -> dict:
+        return await self._request(
+            "POST",
+            "/oauth2/v2.1/token",
+            data={
+                "grant_type": "authorization_code",
+                "code": code,
+                "redirect_uri": redirect_uri,
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+            },
+        )
+
+    async def get_profile(self, access_token: str) -> dict:
+        return await self._request(
+            "GET",
+            "/v2/profile",
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+
+    async def aclose(self):
+        """Close the pool of the running event loop"""
+        entry = self._clients.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            await entry[0].aclose()
+
+
+def create_client(**kwargs) -> LineClient:
+    """Create a client from SHARED_TW_SETTINGS, `kwargs` override the settings"""
+    config = {**settings.SHARED_TW_SETTINGS, **kwargs}
+    return LineClient(
+        api_url=config["line_api_url"],
+        client_id=config["line_client_id"],
+        client_secret=config["line_client_secret"],
+        timeout=httpx.Timeout(
+            config["line_read_timeout"], connect=config["line_connect_timeout"]
+        ),
+        limits=httpx.Limits(
+            max_connections=config["line_max_connections"],
+            max_keepalive_connections=config["line_max_connections"],
+        ),
+        breaker=CircuitBreaker(
+            config["line_breaker_threshold"], config["line_breaker_reset_timeout"]
+        ),
+    )
+
+
+client = create_client()
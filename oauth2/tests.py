@@ -0,0 +1,95 @@
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from benchmarks.stub_line import PROFILE, StubLineServer
+
+from . import line, models
+
+User = get_user_model()
+# AsyncClient of Django 3.2 drops the data of GET
+CALLBACK_URL = "/oauth/line/callback?code=code&state=state"
+
+
+class LineCallbackTestCase(TestCase):
+    def setUp(self):
+        self.stub = StubLineServer()
+        self.stub.start()
+        self.addCleanup(self.stub.stop)
+
+        self.line = line.create_client(
+            line_api_url=self.stub.url,
+            line_read_timeout=0.2,
+            line_breaker_threshold=2,
+        )
+        patcher = mock.patch.object(line, "client", self.line)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.async_client.cookies["line_oauth_state"] = "state"
+        self.async_client.cookies["next"] = "/home"
+
+    async def callback(self):
+        try:
+            return await self.async_client.get(CALLBACK_URL)
+        finally:
+            # The pool belongs to the event loop of this test
+            await self.line.aclose()
+
+    async def test_login(self):
+        resp = await self.async_client.get(CALLBACK_URL)
+        self.assertEqual(resp.status_code, 302)
+        self.assertIn("?token=", resp["Location"])
+        resp = await self.callback()
+        self.assertEqual(resp.status_code, 302)
+
+        # 2 logins, 4 requests over a pooled connection
+        self.assertEqual(self.stub.requests, 4)
+        self.assertEqual(self.stub.connections, 1)
+
+        profile = await sync_to_async(
+            models.Profile.objects.select_related("user").get
+        )(line_id=PROFILE["userId"])
+        self.assertEqual(profile.user.last_name, PROFILE["displayName"])
+        self.assertFalse(profile.user.is_active)
+
+    async def test_invalid_state(self):
+        self.async_client.cookies["line_oauth_state"] = "other"
+        resp = await self.callback()
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(self.stub.requests, 0)
+
+    async def test_timeout(self):
+        self.stub.delay = 0.5
+        resp = await self.callback()
+        self.assertEqual(resp.status_code, 503)
+
+    async def test_circuit_breaker(self):
+        self.stub.status = 500
+        for _ in range(2):
+            self.assertEqual((await self.callback()).status_code, 503)
+        self.assertEqual(self.stub.requests, 2)
+
+        # Open, the LINE API is not called
+        self.stub.status = 200
+        self.assertEqual((await self.callback()).status_code, 503)
+        self.assertEqual(self.stub.requests, 2)
+
+        # Half-open after the reset timeout
+        self.line.breaker.reset_timeout = 0
+        self.assertEqual((await self.callback()).status_code, 302)
+        self.assertIsNone(self.line.breaker.opened_at)
+
+    def test_pool_closed_with_its_loop(self):
+        async def get_profile():
+            await self.line.get_profile("token")
+            return await self.line._client()
+
+        # Like an async view under WSGI, every call runs in a new loop
+        first = async_to_sync(get_profile)()
+        second = async_to_sync(get_profile)()
+        self.assertIsNot(first, second)
+        self.assertTrue(first.is_closed)
+        self.assertTrue(second.is_closed)
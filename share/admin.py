@@ -6,3 +6,4 @@ admin.site.register(models.Organization)
 admin.site.register(models.Donator)
 admin.site.register(models.RequiredItem)
 admin.site.register(models.Donation)
+admin.site.register(models.DonationEvent)
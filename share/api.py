@@ -1,7 +1,10 @@
 import logging
 import typing
 from datetime import date
+from itertools import groupby
+from operator import attrgetter
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import (
     validate_password as django_validate_password,
@@ -11,10 +14,12 @@ from django.db.utils import IntegrityError
 from django.shortcuts import get_object_or_404
 from ninja import Router, errors
 
+from authenticator import hashing
 from authenticator.api import JWTAuthBearer
 from authenticator.utils import send_verification_email
 
-from . import models, schemas
+from . import choices, models, pagination, response_cache, schemas, states
+from .pagination import PaginatedResponse
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -35,9 +40,13 @@ def create_user(
     try:
         django_validate_password(password)
         # FIXME: make is_active=False by default
-        return User.objects.create_user(
-            username=username, password=password, email=email
+        user = User(
+            username=User.normalize_username(username),
+            email=User.objects.normalize_email(email),
+            password=hashing.make_password(password),
         )
+        user.save()
+        return user
     except IntegrityError:
         raise ValueError(f"Username is already existed: {username}")
     except ValidationError as e:
@@ -71,6 +80,8 @@ def create_organization(request, payload: schemas.OrganizationCreation):
         )
     except ValueError as e:
         raise errors.HttpError(400, f"Unable to create user: {e}")
+    except hashing.Overloaded:
+        raise errors.HttpError(503, "Server is busy, please try later.")
 
 
 @router.post(
@@ -100,33 +111,108 @@ def create_donator(request, payload: schemas.DonatorCreation):
         raise errors.HttpError(422, f"Unable to create user: {e}")
 
 
+def filter_required_items(
+    queryset,
+    city: typing.Optional[str] = None,
+    organization_type: typing.Optional[str] = None,
+    unit: typing.Optional[str] = None,
+    collecting: typing.Optional[bool] = None,
+):
+    """Filters of the required items, they are backed by the indexes of
+    `models.Organization` and `models.RequiredItem`"""
+    if city:
+        queryset = queryset.filter(organization__city=city)
+    if organization_type:
+        queryset = queryset.filter(organization__type=organization_type)
+    if unit:
+        queryset = queryset.filter(unit=unit)
+    if collecting is not None:
+        collecting_state = states.CollectingState.state_id()
+        if collecting:
+            queryset = queryset.filter(state=collecting_state)
+        else:
+            queryset = queryset.exclude(state=collecting_state)
+    return queryset
+
+
 @router.get(
     "/required-items",
     auth=None,
-    response=typing.List[schemas.GroupedRequiredItems],
+    response=PaginatedResponse[schemas.GroupedRequiredItems],
     tags=["Donator"],
 )
-def list_required_items(request):
-    items = models.RequiredItem.objects.prefetch_related("donations").filter(
-        ended_date__gte=date.today()
-    )
-    grouped_items = {}
-    for i in items:
-        g = grouped_items.setdefault(
-            i.organization.id, schemas.GroupedRequiredItems(organization=i.organization)
+async def list_required_items(
+    request,
+    city: choices.Cities = None,
+    organization_type: choices.OrganizationTypes = None,
+    unit: choices.Units = None,
+    collecting: bool = None,
+    cursor: str = None,
+    page_size: int = pagination.PAGE_SIZE,
+):
+    def build():
+        items = filter_required_items(
+            models.RequiredItem.objects.select_related("organization")
+            .prefetch_related("donations")
+            .filter(ended_date__gte=today),
+            city=city,
+            organization_type=organization_type,
+            unit=unit,
+            collecting=collecting,
+        )
+        # Items of an organization are kept together, a group might continue
+        # on the next page. All the keys descend, so that the (organization,
+        # ended_date, id) index is scanned backward.
+        page = pagination.paginate(
+            request,
+            items,
+            ordering=("-organization_id", "-ended_date", "-id"),
+            cursor=cursor,
+            page_size=page_size,
         )
-        g.items.append(i)
-    return [i.dict() for i in grouped_items.values()]
+        return PaginatedResponse[schemas.GroupedRequiredItems](
+            next=page.next,
+            previous=page.previous,
+            results=[
+                schemas.GroupedRequiredItems(
+                    organization=organization, items=list(group)
+                )
+                for organization, group in groupby(
+                    page.items, key=attrgetter("organization")
+                )
+            ],
+        ).dict()
+
+    today = date.today()
+    # No async ORM nor cache in Django 3.2, the cache hit is a cache lookup
+    # and the miss is a few queries, both in a thread.
+    return await sync_to_async(response_cache.cached_json_response)(
+        request,
+        "required-items",
+        build,
+        params=(today, request.build_absolute_uri()),
+    )
 
 
 @router.get(
     "/organization/required-items",
-    response=typing.List[schemas.RequiredItem],
+    response=PaginatedResponse[schemas.RequiredItem],
     tags=["Organization"],
 )
-def list_organization_required_items(request):
-    items = models.RequiredItem.objects.filter(organization__user=request.user)
-    return items
+def list_organization_required_items(
+    request, cursor: str = None, page_size: int = pagination.PAGE_SIZE
+):
+    items = models.RequiredItem.objects.prefetch_related("donations").filter(
+        organization__user=request.user
+    )
+    return pagination.render(
+        request,
+        schema_cls=schemas.RequiredItem,
+        queryset=items,
+        ordering=("-ended_date", "-id"),
+        cursor=cursor,
+        page_size=page_size,
+    )
 
 
 @router.post(
@@ -182,11 +268,12 @@ def edit_organization_donation(
     tags=["Donator"],
 )
 def create_donation(request, payload: typing.List[schemas.DonationCreation]):
+    required_items = models.RequiredItem.objects.in_bulk({d.id for d in payload})
     result = [None] * len(payload)
+    donations = {}
     for i, donation in enumerate(payload):
-        try:
-            required_item = models.RequiredItem.objects.get(id=donation.id)
-        except models.RequiredItem.DoesNotExist:
+        required_item = required_items.get(donation.id)
+        if required_item is None:
             result[i] = schemas.SetDonationResult(
                 message=f"Required item ID doesn't exist: {donation.id}"
             )
@@ -202,7 +289,7 @@ def create_donation(request, payload: typing.List[schemas.DonationCreation]):
             )
             continue
 
-        donation = models.Donation.objects.create(
+        donations[i] = models.Donation(
             required_item=required_item,
             created_by=request.user,
             **donation.dict(
@@ -211,15 +298,28 @@ def create_donation(request, payload: typing.List[schemas.DonationCreation]):
                 }
             ),
         )
+
+    models.Donation.create_in_bulk(donations.values())
+    for i, donation in donations.items():
         result[i] = schemas.SetDonationResult(donation=donation)
     return result
 
 
-@router.get("/donations", response=typing.List[schemas.Donation], tags=["Donator"])
-def list_donations(request):
-    return models.Donation.objects.select_related("required_item").filter(
+@router.get(
+    "/donations", response=PaginatedResponse[schemas.Donation], tags=["Donator"]
+)
+def list_donations(request, cursor: str = None, page_size: int = pagination.PAGE_SIZE):
+    donations = models.Donation.objects.select_related("required_item").filter(
         created_by=request.user
     )
+    return pagination.render(
+        request,
+        schema_cls=schemas.Donation,
+        queryset=donations,
+        ordering=("-created_at", "-id"),
+        cursor=cursor,
+        page_size=page_size,
+    )
 
 
 @router.patch(
@@ -228,23 +328,16 @@ def list_donations(request):
     tags=["Donator"],
 )
 def edit_donation(request, payload: typing.List[schemas.DonationModification]):
-    result = [None] * len(payload)
-    for i, mod in enumerate(payload):
-        try:
-            donation = models.Donation.objects.get(id=mod.id)
-        except models.Donation.DoesNotExist:
-            result[i] = schemas.SetDonationResult(
-                message=f"Donation ID doesn't exist: {mod.id}"
-            )
-            continue
-
-        try:
-            donation.set_event(request.user, mod.dict())
-            result[i] = schemas.SetDonationResult(donation=donation)
-        except ValueError as e:
-            result[i] = schemas.SetDonationResult(
-                message=f"fail to add new event, reason: {e}"
+    result = []
+    for r in models.Donation.set_events(request.user, [m.dict() for m in payload]):
+        if isinstance(r, models.Donation.DoesNotExist):
+            result.append(schemas.SetDonationResult(message=str(r)))
+        elif isinstance(r, ValueError):
+            result.append(
+                schemas.SetDonationResult(message=f"fail to add new event, reason: {r}")
             )
+        else:
+            result.append(schemas.SetDonationResult(donation=r))
     return result
 
 
@@ -253,7 +346,7 @@ def get_users_me(request):
     kwargs = {}
     if hasattr(request.user, "donator"):
         extra_info = request.user.donator
-        kwargs["name"] = request.uset.get_full_name()
+        kwargs["name"] = request.user.get_full_name()
     elif hasattr(request.user, "organization"):
         extra_info = request.user.organization
         kwargs["name"] = extra_info.name
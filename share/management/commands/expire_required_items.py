@@ -0,0 +1,37 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from share import models
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Cancel the over-due required items and their open donations"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Keep running and sweep every INTERVAL seconds",
+        )
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            try:
+                expired = models.RequiredItem.expire_overdue(options["chunk_size"])
+                self.stdout.write(f"Cancelled {expired} required item(s).")
+            except Exception:
+                if not options["interval"]:
+                    raise
+                logger.exception("Fail to cancel the over-due required items")
+
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from share import models
+
+
+class Command(BaseCommand):
+    help = "Recalculate the approved/delivered amounts of the required items"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "ids", nargs="*", type=int, help="Only check the given required items"
+        )
+
+    def handle(self, *args, **options):
+        queryset = models.RequiredItem.objects.all()
+        if options["ids"]:
+            queryset = queryset.filter(id__in=options["ids"])
+
+        repaired = models.RequiredItem.refresh_amounts(queryset)
+        self.stdout.write(f"Repaired {repaired} required item(s).")
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from share import models, states
+
+
+class Command(BaseCommand):
+    help = "Replay the events of the donations and report the mismatched states"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        last_id = 0
+        checked = mismatched = 0
+        while True:
+            donations = dict(
+                models.Donation.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", "state")[: options["chunk_size"]]
+            )
+            if not donations:
+                break
+
+            histories = {donation_id: [] for donation_id in donations}
+            for donation_id, name in (
+                models.DonationEvent.objects.filter(donation_id__in=donations.keys())
+                .order_by("donation_id", "created_at", "id")
+                .values_list("donation_id", "name")
+            ):
+                histories[donation_id].append(name)
+
+            for donation_id, state in donations.items():
+                replayed = states.replay(histories[donation_id])
+                if replayed != state:
+                    mismatched += 1
+                    self.stdout.write(
+                        f"Donation {donation_id}: stored {state}, replayed {replayed}"
+                    )
+            checked += len(donations)
+            last_id = max(donations)
+
+        self.stdout.write(f"Checked {checked} donation(s), {mismatched} mismatched.")
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:15
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+APPROVED_DONATION_STATES = ("PendingDispatchState", "DoneState")
+DELIVERED_DONATION_STATES = ("DoneState",)
+
+
+def backfill_amounts(apps, schema_editor):
+    RequiredItem = apps.get_model("share", "RequiredItem")
+    Donation = apps.get_model("share", "Donation")
+
+    def total(donation_states):
+        donations = (
+            Donation.objects.filter(
+                required_item=OuterRef("pk"), state__in=donation_states
+            )
+            .values("required_item")
+            .annotate(total=Sum("amount"))
+            .values("total")
+        )
+        return Coalesce(Subquery(donations), 0)
+
+    RequiredItem.objects.update(
+        approved_amount=total(APPROVED_DONATION_STATES),
+        delivered_amount=total(DELIVERED_DONATION_STATES),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("share", "0002_auto_20210703_0821"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="requireditem",
+            name="approved_amount",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="requireditem",
+            name="delivered_amount",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_amounts, migrations.RunPython.noop),
+    ]
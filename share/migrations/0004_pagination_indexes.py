@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("share", "0003_required_item_amounts"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="donation",
+            index=models.Index(
+                fields=["created_by", "created_at", "id"],
+                name="share_donat_created_eb5abb_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="requireditem",
+            index=models.Index(
+                fields=["organization", "ended_date", "id"],
+                name="share_requi_organiz_c25156_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("share", "0004_pagination_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="organization",
+            index=models.Index(fields=["city", "type"], name="share_org_city_type_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="requireditem",
+            index=models.Index(
+                fields=["state", "unit", "ended_date"], name="share_item_state_unit_idx"
+            ),
+        ),
+    ]
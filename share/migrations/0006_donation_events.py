@@ -0,0 +1,129 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:23
+
+from collections import defaultdict
+from datetime import datetime
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def move_events(apps, schema_editor):
+    Donation = apps.get_model("share", "Donation")
+    DonationEvent = apps.get_model("share", "DonationEvent")
+
+    donation_events = []
+    for donation_id, events in Donation.objects.values_list("id", "events").iterator():
+        for e in events or []:
+            donation_events.append(
+                DonationEvent(
+                    donation_id=donation_id,
+                    name=e["name"],
+                    comment=e.get("comment", ""),
+                    created_at=datetime.fromtimestamp(e["timestamp"], tz=timezone.utc),
+                )
+            )
+        if len(donation_events) >= 1000:
+            DonationEvent.objects.bulk_create(donation_events)
+            donation_events = []
+    DonationEvent.objects.bulk_create(donation_events)
+
+
+def fold_events(apps, schema_editor):
+    """Fold the events back into `Donation.events`, dropping `created_by`"""
+    Donation = apps.get_model("share", "Donation")
+    DonationEvent = apps.get_model("share", "DonationEvent")
+
+    events = defaultdict(list)
+    for donation_id, name, comment, created_at in (
+        DonationEvent.objects.order_by("donation_id", "created_at", "id")
+        .values_list("donation_id", "name", "comment", "created_at")
+        .iterator()
+    ):
+        events[donation_id].append(
+            {"name": name, "timestamp": created_at.timestamp(), "comment": comment}
+        )
+
+    # `Donation(events=...)` would set the reverse relation of the events
+    for donation_id, donation_events in events.items():
+        Donation.objects.filter(id=donation_id).update(events=donation_events)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("share", "0005_required_item_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DonationEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "name",
+                    models.CharField(
+                        choices=[
+                            ("DonationApprovedEvent", "Donationapprovedevent"),
+                            ("DonationDeliveredEvent", "Donationdeliveredevent"),
+                            ("DonationCancelledEvent", "Donationcancelledevent"),
+                            ("DonationDispatchedEvent", "Donationdispatchedevent"),
+                        ],
+                        max_length=64,
+                    ),
+                ),
+                ("comment", models.TextField(blank=True, default="")),
+                (
+                    "created_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "donation",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="events",
+                        to="share.donation",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["created_at", "id"],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="donationevent",
+            index=models.Index(
+                fields=["donation", "created_at"], name="share_donat_donatio_b84b9b_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="donationevent",
+            index=models.Index(
+                fields=["name", "created_at"], name="share_donat_name_e77604_idx"
+            ),
+        ),
+        migrations.RunPython(move_events, fold_events),
+        migrations.RemoveField(
+            model_name="donation",
+            name="events",
+        ),
+    ]
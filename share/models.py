@@ -1,13 +1,20 @@
 import logging
 import typing
-from datetime import date
+from collections import defaultdict
+from datetime import date, datetime
 
 from django.contrib.auth import get_user_model
-from django.db import OperationalError, models, transaction
-from django.db.models.signals import post_save
+from django.db import models, transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 
-from . import schemas, states
+from api import metrics
+from authenticator import principals
+
+from . import response_cache, schemas, states
 from .choices import Cities, ContactMethods, OrganizationTypes, Units
 
 User = get_user_model()
@@ -29,6 +36,11 @@ class Organization(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["city", "type"], name="share_org_city_type_idx"),
+        ]
+
 
 class Donator(models.Model):
     phone = models.CharField(max_length=15)
@@ -56,41 +68,135 @@ class RequiredItem(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
 
-    @property
-    def approved_amount(self):
-        amount = 0
-        for d in self.donations.all():
-            if d.state in (
-                states.PendingDispatchState.state_id(),
-                states.DoneState.state_id(),
-            ):
-                amount += d.amount
-        return amount
+    # Aggregated from the donations, see `Donation.set_event`
+    approved_amount = models.PositiveIntegerField(default=0)
+    delivered_amount = models.PositiveIntegerField(default=0)
 
-    @property
-    def delivered_amount(self):
-        amount = 0
-        for d in self.donations.all():
-            if d.state == states.DoneState.state_id():
-                amount += d.amount
-        return amount
+    @classmethod
+    def add_amounts(cls, required_item_id: int, approved: int, delivered: int):
+        if not approved and not delivered:
+            return
+        cls.objects.filter(id=required_item_id).update(
+            approved_amount=F("approved_amount") + approved,
+            delivered_amount=F("delivered_amount") + delivered,
+        )
+
+    @classmethod
+    def refresh_amounts(cls, queryset=None) -> int:
+        """Recalculate the aggregated amounts from the donations.
+
+        Returns the number of the repaired required items.
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+
+        items = queryset.annotate(
+            real_approved_amount=Coalesce(
+                Sum(
+                    "donations__amount",
+                    filter=Q(donations__state__in=APPROVED_DONATION_STATES),
+                ),
+                0,
+            ),
+            real_delivered_amount=Coalesce(
+                Sum(
+                    "donations__amount",
+                    filter=Q(donations__state__in=DELIVERED_DONATION_STATES),
+                ),
+                0,
+            ),
+        ).filter(
+            ~Q(approved_amount=F("real_approved_amount"))
+            | ~Q(delivered_amount=F("real_delivered_amount"))
+        )
+
+        repaired = 0
+        for item in items.only("id").iterator():
+            cls.objects.filter(id=item.id).update(
+                approved_amount=item.real_approved_amount,
+                delivered_amount=item.real_delivered_amount,
+            )
+            repaired += 1
+        if repaired:
+            # `update` sends no signals
+            response_cache.bump_data_version_on_commit()
+        return repaired
 
     def cancel(self, user, comment: str):
         if not self.is_valid():
             return
 
-        for d in self.donations.all():
-            try:
-                d.set_event(
-                    user,
+        with transaction.atomic():
+            self.state = states.CancelledState.state_id()
+            # Do not overwrite the amounts which are updated by the donations
+            self.save(update_fields=["state", "modified_at"])
+
+            open_donations = self.donations.filter(state__in=OPEN_DONATION_STATES)
+            Donation.set_events(
+                user,
+                [
                     schemas.DonationModification(
-                        event=states.DonationCancelledEvent.event_id(), comment=comment
-                    ).dict(),
+                        id=donation_id,
+                        event=states.DonationCancelledEvent.event_id(),
+                        comment=comment,
+                    ).dict()
+                    for donation_id in open_donations.values_list("id", flat=True)
+                ],
+            )
+
+    @classmethod
+    def expire_overdue(cls, chunk_size: int = 500) -> int:
+        """Cancel the over-due required items and their open donations
+
+        The items are handled in chunks of set-based UPDATEs. Locked items are
+        skipped so the sweepers on several nodes can run at the same time.
+        Returns the number of the cancelled required items.
+        """
+        expired = 0
+        while True:
+            with transaction.atomic():
+                ids = list(
+                    cls.objects.filter(
+                        state=states.CollectingState.state_id(),
+                        ended_date__lt=date.today(),
+                    )
+                    .order_by("id")
+                    .select_for_update(skip_locked=True)
+                    .values_list("id", flat=True)[:chunk_size]
                 )
-            except ValueError:
-                pass
-        self.state = states.CancelledState.state_id()
-        self.save()
+                if not ids:
+                    break
+
+                now = timezone.now()
+                donation_ids = list(
+                    Donation.objects.filter(
+                        required_item_id__in=ids, state__in=OPEN_DONATION_STATES
+                    )
+                    .select_for_update()
+                    .values_list("id", flat=True)
+                )
+                Donation.objects.filter(id__in=donation_ids).update(
+                    state=states.CancelledState.state_id(), modified_at=now
+                )
+                DonationEvent.objects.bulk_create(
+                    DonationEvent(
+                        donation_id=donation_id,
+                        name=states.DonationCancelledEvent.event_id(),
+                        comment="Over-due",
+                        created_at=now,
+                    )
+                    for donation_id in donation_ids
+                )
+                cls.objects.filter(id__in=ids).update(
+                    state=states.CancelledState.state_id(),
+                    # Only the done donations are left approved
+                    approved_amount=F("delivered_amount"),
+                    modified_at=now,
+                )
+                response_cache.bump_data_version_on_commit()
+            expired += len(ids)
+            logger.info("Cancelled %d over-due required items", len(ids))
+        return expired
 
     def is_valid(self) -> bool:
         if self.state == states.CollectingState.state_id():
@@ -104,12 +210,42 @@ class RequiredItem(models.Model):
         # TODO: lock?
         if self.ended_date < date.today():
             self.cancel(self.organization.user, "Over-due")
+            return
         if self.delivered_amount > self.amount:
             self.state = states.DoneState.state_id()
-        self.save()
+        self.save(update_fields=["state", "modified_at"])
 
     class Meta:
         ordering = ["-ended_date"]
+        indexes = [
+            # Keyset pagination, see `share.api.list_required_items`
+            models.Index(fields=["organization", "ended_date", "id"]),
+            # Filters, see `share.api.filter_required_items`
+            models.Index(
+                fields=["state", "unit", "ended_date"],
+                name="share_item_state_unit_idx",
+            ),
+        ]
+
+
+APPROVED_DONATION_STATES = (
+    states.PendingDispatchState.state_id(),
+    states.DoneState.state_id(),
+)
+DELIVERED_DONATION_STATES = (states.DoneState.state_id(),)
+OPEN_DONATION_STATES = (
+    states.PendingApprovalState.state_id(),
+    states.PendingDispatchState.state_id(),
+    states.PendingDeliveryState.state_id(),
+)
+
+
+def counted_amounts(state: str, amount: int) -> typing.Tuple[int, int]:
+    """Return the (approved, delivered) amounts of a donation in `state`"""
+    return (
+        amount if state in APPROVED_DONATION_STATES else 0,
+        amount if state in DELIVERED_DONATION_STATES else 0,
+    )
 
 
 class Donation(models.Model):
@@ -123,64 +259,262 @@ class Donation(models.Model):
         choices=states.DonationStateEnum.choices,
     )
     excepted_delivery_date = models.DateField(null=True)
-    events = models.JSONField(default=list)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
 
+    # The (required item ID, approved, delivered) amounts which the stored
+    # required item counts for this donation, see `sync_amounts`
+    _counted = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        donation = super().from_db(db, field_names, values)
+        if not {"required_item_id", "amount", "state"} & donation.get_deferred_fields():
+            donation._counted = donation._current_amounts()
+        return donation
+
+    def _current_amounts(self) -> typing.Tuple[int, int, int]:
+        return (self.required_item_id, *counted_amounts(self.state, self.amount))
+
+    def sync_amounts(self, deleted: bool = False):
+        """Apply a saved or deleted donation to the amounts of its required item
+
+        For the donations which are saved one by one, e.g. by the admin;
+        `set_events` updates the amounts of its batch itself. Returns whether
+        any amount changed.
+        """
+        amounts = defaultdict(lambda: [0, 0])
+        if self._counted is not None:
+            required_item_id, approved, delivered = self._counted
+            amounts[required_item_id][0] -= approved
+            amounts[required_item_id][1] -= delivered
+        self._counted = None
+        if not deleted:
+            self._counted = self._current_amounts()
+            required_item_id, approved, delivered = self._counted
+            amounts[required_item_id][0] += approved
+            amounts[required_item_id][1] += delivered
+
+        changed = False
+        for required_item_id in sorted(amounts):
+            approved, delivered = amounts[required_item_id]
+            RequiredItem.add_amounts(required_item_id, approved, delivered)
+            changed = changed or bool(approved or delivered)
+        return changed
+
     @property
     def required_item_name(self) -> str:
         return self.required_item.name
 
+    @classmethod
+    def create_in_bulk(cls, donations: typing.Iterable["Donation"]):
+        """Insert the donations at once and refresh each required item once
+
+        `bulk_create` skips the `post_save` signals which are handled here.
+        """
+        donations = list(donations)
+        if not donations:
+            return
+
+        with transaction.atomic():
+            cls.objects.bulk_create(donations)
+            required_items = {d.required_item_id: d.required_item for d in donations}
+            for required_item in required_items.values():
+                required_item.calc_state()
+            response_cache.bump_data_version_on_commit()
+
     def calc_state(self) -> states.State:
-        current_state = states.get_state(self.state)
-        for raw_event in self.events:
-            e = states.get_event(raw_event)
-            if e.timestamp < self.modified_at.timestamp():
-                continue
-            current_state = current_state.apply(e)
-        return current_state
+        """Replay all the stored events, the result should equal `self.state`"""
+        return states.get_state(
+            states.replay(self.events.values_list("name", flat=True))
+        )
 
-    def set_event(self, user, raw_event: typing.Dict):
-        try:
-            event = states.get_event(raw_event)
-            if not hasattr(user, "organization") and not hasattr(user, "donator"):
-                raise ValueError("Invalid user account")
-            elif hasattr(user, "organization") and not isinstance(
-                event, states.organization_events
-            ):
-                raise ValueError(f"Invalid event of the organization: {event.name}")
-            elif hasattr(user, "donator") and not isinstance(
-                event, states.donator_events
-            ):
-                raise ValueError(f"Invalid event of the donator: {event.name}")
-        except ValueError as e:
-            raise e
+    @staticmethod
+    def check_event(user, raw_event: typing.Dict) -> states.Event:
+        event = states.get_event(raw_event)
+        if not hasattr(user, "organization") and not hasattr(user, "donator"):
+            raise ValueError("Invalid user account")
+        elif hasattr(user, "organization") and not isinstance(
+            event, states.organization_events
+        ):
+            raise ValueError(f"Invalid event of the organization: {event.name}")
+        elif hasattr(user, "donator") and not isinstance(event, states.donator_events):
+            raise ValueError(f"Invalid event of the donator: {event.name}")
+        return event
+
+    def apply_event(self, event: states.Event) -> typing.Tuple[int, int]:
+        """Apply the event in memory
 
+        Returns the changes of the (approved, delivered) amounts.
+        """
         if self.state in (
             states.InvalidState.state_id(),
             states.CancelledState.state_id(),
         ):
             raise ValueError("This donation is already invalid or cancelled.")
 
+        new_state = states.transition(self.state, event.name)
+        if new_state == states.InvalidState.state_id():
+            raise ValueError("An invalid state has been generated.")
+
+        old_approved, old_delivered = counted_amounts(self.state, self.amount)
+        self.state = new_state
+        new_approved, new_delivered = counted_amounts(self.state, self.amount)
+        return new_approved - old_approved, new_delivered - old_delivered
+
+    def set_event(self, user, raw_event: typing.Dict):
+        result = self.set_events(user, [dict(raw_event, id=self.id)])[0]
+        if isinstance(result, Exception):
+            raise ValueError(str(result))
+
+        self.state = result.state
+        self.modified_at = result.modified_at
+
+    @classmethod
+    def set_events(
+        cls, user, raw_events: typing.Sequence[typing.Dict]
+    ) -> typing.List[typing.Union["Donation", Exception]]:
+        """Apply the events to the donations of their `id` in a batch
+
+        The required items and then the donations are locked in the order of
+        their IDs, like `RequiredItem.expire_overdue` and `RequiredItem.cancel`,
+        to avoid deadlocks; the required items are refreshed once. Returns the
+        updated donation or the error of each event.
+        """
+        results = [None] * len(raw_events)
+        ids = {e["id"] for e in raw_events}
         with transaction.atomic():
-            try:
-                donation = (
-                    self.__class__.objects.filter(id=self.id)
-                    .select_for_update(nowait=True)
-                    .get()
-                )
-            except OperationalError:
-                raise ValueError(f"Unable to lock the donation: {id}")
+            list(
+                RequiredItem.objects.filter(donations__id__in=ids)
+                .order_by("id")
+                .select_for_update(of=("self",))
+                .values_list("id", flat=True)
+            )
+            donations = (
+                cls.objects.select_related("required_item")
+                .filter(id__in=ids)
+                .order_by("id")
+                .select_for_update(of=("self",))
+            )
+            donations = {d.id: d for d in donations}
 
-            donation.events.append(event.dict())
-            new_state = donation.calc_state()
-            if isinstance(new_state, states.InvalidState):
-                raise ValueError("An invalid state has been generated.")
-            donation.state = new_state.state_id()
-            donation.save()
+            updated = {}
+            new_events = []
+            amounts = defaultdict(lambda: [0, 0])
+            transitions = defaultdict(int)
+            for i, raw_event in enumerate(raw_events):
+                donation = donations.get(raw_event["id"])
+                if donation is None:
+                    results[i] = cls.DoesNotExist(
+                        f"Donation ID doesn't exist: {raw_event['id']}"
+                    )
+                    continue
+
+                try:
+                    event = cls.check_event(user, raw_event)
+                    approved, delivered = donation.apply_event(event)
+                except ValueError as e:
+                    results[i] = e
+                    continue
+
+                new_events.append(DonationEvent.from_event(donation, event, user))
+                transitions[event.name, donation.state] += 1
+                amounts[donation.required_item_id][0] += approved
+                amounts[donation.required_item_id][1] += delivered
+                updated[donation.id] = donation
+                results[i] = donation
+
+            if not updated:
+                return results
+
+            now = timezone.now()
+            for donation in updated.values():
+                donation.modified_at = now
+                donation._counted = donation._current_amounts()
+            cls.objects.bulk_update(updated.values(), ["state", "modified_at"])
+            DonationEvent.objects.bulk_create(new_events)
+            for required_item_id in sorted(amounts):
+                approved, delivered = amounts[required_item_id]
+                RequiredItem.add_amounts(required_item_id, approved, delivered)
+            for required_item in (
+                RequiredItem.objects.filter(id__in=amounts.keys())
+                .select_related("organization__user")
+                .order_by("id")
+            ):
+                required_item.calc_state()
+            response_cache.bump_data_version_on_commit()
+            transaction.on_commit(lambda: metrics.count_transitions(transitions))
+        return results
+
+    class Meta:
+        indexes = [
+            # Keyset pagination, see `share.api.list_donations`
+            models.Index(fields=["created_by", "created_at", "id"]),
+        ]
+
+
+class DonationEvent(models.Model):
+    """Append-only history of the donation events"""
+
+    donation = models.ForeignKey(
+        Donation, on_delete=models.CASCADE, related_name="events"
+    )
+    name = models.CharField(max_length=64, choices=states.EventEnum.choices)
+    comment = models.TextField(blank=True, default="")
+    # Empty if the event is generated by the system, e.g. over-due
+    created_by = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def from_event(cls, donation: Donation, event: states.Event, user=None):
+        return cls(
+            donation=donation,
+            name=event.name,
+            comment=event.comment,
+            created_by=user,
+            created_at=datetime.fromtimestamp(event.timestamp, tz=timezone.utc),
+        )
+
+    def to_event(self) -> states.Event:
+        return states.get_event(
+            dict(
+                name=self.name,
+                comment=self.comment,
+                timestamp=self.created_at.timestamp(),
+            )
+        )
+
+    class Meta:
+        ordering = ["created_at", "id"]
+        indexes = [
+            models.Index(fields=["donation", "created_at"]),
+            models.Index(fields=["name", "created_at"]),
+        ]
 
 
 @receiver(post_save, sender=Donation)
 def refresh_required_item(sender, instance, **kwargs):
+    if instance.sync_amounts():
+        instance.required_item.refresh_from_db(
+            fields=["approved_amount", "delivered_amount"]
+        )
     instance.required_item.calc_state()
+
+
+@receiver(post_delete, sender=Donation)
+def subtract_amounts(sender, instance, **kwargs):
+    instance.sync_amounts(deleted=True)
+
+
+@receiver([post_save, post_delete], sender=Organization)
+@receiver([post_save, post_delete], sender=RequiredItem)
+@receiver([post_save, post_delete], sender=Donation)
+def invalidate_response_cache(sender, **kwargs):
+    response_cache.bump_data_version_on_commit()
+
+
+@receiver([post_save, post_delete], sender=Organization)
+@receiver([post_save, post_delete], sender=Donator)
+def invalidate_principal(sender, instance, **kwargs):
+    principals.invalidate_on_commit(instance.user_id)
@@ -1,13 +1,23 @@
 # Borrow from https://github.com/vitalik/django-ninja/issues/104#issuecomment-805939752
 
-from typing import Any, Generic, List, Optional, TypeVar
+import base64
+import binascii
+import datetime
+import json
+from operator import attrgetter
+from typing import Any, Generic, List, NamedTuple, Optional, Sequence, Tuple, TypeVar
 from urllib import parse
 
 import pydantic
-from django.core.paginator import Page, Paginator
+from django.core.exceptions import ValidationError
+from django.db.models import Q, QuerySet
 from django.utils.encoding import force_str
+from ninja import errors
 from pydantic.generics import GenericModel
 
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
 
 def replace_query_param(url, key, val):
     """
@@ -24,26 +34,128 @@ def replace_query_param(url, key, val):
     return parse.urlunsplit((scheme, netloc, path, query, fragment))
 
 
-def get_next_page_url(request, page: Page) -> Optional[str]:
-    if not page.has_next():
-        return None
-    return replace_query_param(request.build_absolute_uri(), "page", page.number + 1)
+def encode_cursor(values: Sequence[Any], reverse: bool) -> str:
+    values = [
+        v.isoformat() if isinstance(v, (datetime.date, datetime.datetime)) else v
+        for v in values
+    ]
+    data = json.dumps([values, reverse], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[List[Any], bool]:
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values, reverse = json.loads(data)
+        if not isinstance(values, list) or not isinstance(reverse, bool):
+            raise ValueError(cursor)
+    except (binascii.Error, ValueError, TypeError):
+        raise errors.HttpError(400, f"Invalid cursor: {cursor}")
+    return values, reverse
+
+
+def _field_name(key: str) -> str:
+    return key[1:] if key.startswith("-") else key
+
+
+def _reverse_ordering(ordering: Sequence[str]) -> List[str]:
+    return [_field_name(k) if k.startswith("-") else f"-{k}" for k in ordering]
 
 
-def get_previous_page_url(request, page: Page) -> Optional[str]:
-    if not page.has_previous():
-        return None
-    return replace_query_param(request.build_absolute_uri(), "page", page.number - 1)
+def _after(ordering: Sequence[str], values: Sequence[Any]) -> Q:
+    """Filter the rows which come after `values` in the `ordering`"""
+    q = Q()
+    for i, key in enumerate(ordering):
+        lookup = "lt" if key.startswith("-") else "gt"
+        kwargs = {_field_name(k): v for k, v in zip(ordering[:i], values)}
+        kwargs[f"{_field_name(key)}__{lookup}"] = values[i]
+        q |= Q(**kwargs)
+    return q
 
 
-def render(request, *, schema_cls: Any, items: Any, page: int, page_size: int = 20):
-    page = Paginator(items, per_page=page_size).get_page(page)
-    items = [schema_cls.from_orm(item) for item in items]
+def _fetch(
+    queryset: QuerySet,
+    order: Sequence[str],
+    values: Optional[Sequence[Any]],
+    limit: int,
+) -> List[Any]:
+    """The first `limit` rows after `values`, if any, in the `order`"""
+    if values is not None:
+        queryset = queryset.filter(_after(order, values))
+    return list(queryset.order_by(*order)[:limit])
+
+
+class CursorPage(NamedTuple):
+    items: List[Any]
+    next: Optional[str]
+    previous: Optional[str]
+
+
+def paginate(
+    request,
+    queryset: QuerySet,
+    *,
+    ordering: Sequence[str],
+    cursor: Optional[str] = None,
+    page_size: int = PAGE_SIZE,
+) -> CursorPage:
+    """Keyset pagination of the `queryset`
+
+    The `ordering` must be unique, e.g. end with the primary key, so that
+    every page costs the same index scan instead of an OFFSET.
+    """
+    page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+    values, reverse = None, False
+    if cursor:
+        values, reverse = decode_cursor(cursor)
+        if len(values) != len(ordering):
+            raise errors.HttpError(400, f"Invalid cursor: {cursor}")
+
+    order = _reverse_ordering(ordering) if reverse else list(ordering)
+    try:
+        items = _fetch(queryset, order, values, page_size + 1)
+    except (ValueError, TypeError, ValidationError):
+        # A well-formed cursor with the values of the wrong types
+        raise errors.HttpError(400, f"Invalid cursor: {cursor}")
+    has_more = len(items) > page_size
+    items = items[:page_size]
+    if reverse:
+        items.reverse()
+
+    get_values = attrgetter(*[_field_name(k) for k in ordering])
+
+    def url(item, reverse: bool) -> str:
+        values = get_values(item)
+        if len(ordering) == 1:
+            values = (values,)
+        return replace_query_param(
+            request.build_absolute_uri(), "cursor", encode_cursor(values, reverse)
+        )
+
+    next_url = previous_url = None
+    if items and (reverse or has_more):
+        next_url = url(items[-1], False)
+    if items and (has_more if reverse else bool(cursor)):
+        previous_url = url(items[0], True)
+    return CursorPage(items, next_url, previous_url)
+
+
+def render(
+    request,
+    *,
+    schema_cls: Any,
+    queryset: QuerySet,
+    ordering: Sequence[str],
+    cursor: Optional[str] = None,
+    page_size: int = PAGE_SIZE,
+):
+    page = paginate(
+        request, queryset, ordering=ordering, cursor=cursor, page_size=page_size
+    )
     return PaginatedResponse[schema_cls](
-        count=page.paginator.count,
-        next=get_next_page_url(request, page),
-        previous=get_previous_page_url(request, page),
-        results=items,
+        next=page.next,
+        previous=page.previous,
+        results=[schema_cls.from_orm(item) for item in page.items],
     )
 
 
@@ -52,7 +164,6 @@ GenericResultsType = TypeVar("GenericResultsType")
 
 
 class PaginatedResponse(GenericModel, Generic[GenericResultsType]):
-    count: int
     next: Optional[pydantic.AnyHttpUrl]
     previous: Optional[pydantic.AnyHttpUrl]
     results: List[GenericResultsType]
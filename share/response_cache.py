@@ -0,0 +1,74 @@
+import hashlib
+import json
+import logging
+import typing
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import parse_etags
+from ninja.responses import NinjaJSONEncoder
+
+from api import metrics
+
+logger = logging.getLogger(__name__)
+
+DATA_VERSION_KEY = "share:data-version"
+RESPONSE_TIMEOUT = 60 * 60
+
+
+def get_data_version() -> str:
+    version = cache.get(DATA_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(DATA_VERSION_KEY, version, timeout=None):
+            version = cache.get(DATA_VERSION_KEY, version)
+    return version
+
+
+def bump_data_version():
+    # A random version instead of cache.incr() so that concurrent bumps never
+    # collapse into the same version.
+    cache.set(DATA_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def bump_data_version_on_commit():
+    """Invalidate the cached responses now and again once the data is committed.
+
+    The second bump prevents a response which is built from the not yet
+    committed data from being cached under the new version.
+    """
+    bump_data_version()
+    transaction.on_commit(bump_data_version)
+
+
+def cached_json_response(
+    request,
+    name: str,
+    build: typing.Callable[[], typing.Any],
+    params: typing.Iterable[typing.Any] = (),
+) -> HttpResponse:
+    """Return the JSON response of `build()` cached by the data version.
+
+    `params` should contain everything else the response depends on,
+    e.g. the query parameters.
+    """
+    digest = hashlib.md5(repr(tuple(params)).encode()).hexdigest()
+    key = f"share:response:{name}:{get_data_version()}:{digest}"
+
+    entry = cache.get(key)
+    metrics.count_cache("response", hit=entry is not None)
+    if entry is None:
+        logger.debug("Cache miss: %s", key)
+        content = json.dumps(build(), cls=NinjaJSONEncoder).encode()
+        entry = (f'"{hashlib.md5(content).hexdigest()}"', content)
+        cache.set(key, entry, RESPONSE_TIMEOUT)
+    etag, content = entry
+
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        resp = HttpResponseNotModified()
+    else:
+        resp = HttpResponse(content, content_type="application/json")
+    resp["ETag"] = etag
+    return resp
@@ -0,0 +1,155 @@
+"""Synthetic data for the benchmarks and the query budget tests
+
+The data is generated from a random seed, so the same arguments produce the
+same rows. The rows are inserted in bulk, which skips the signals; the
+aggregated amounts and the response cache are refreshed at the end.
+"""
+import random
+import typing
+from datetime import date, timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from . import choices, models, response_cache, states
+
+User = get_user_model()
+
+PASSWORD = "password"
+
+# The histories of the donations and their weights, see `states.transitions`
+HISTORIES = (
+    ((), 4),
+    ((states.DonationApprovedEvent,), 3),
+    # Dispatched is the last step, it moves the donation to DoneState
+    ((states.DonationApprovedEvent, states.DonationDispatchedEvent), 4),
+    ((states.DonationCancelledEvent,), 1),
+    ((states.DonationApprovedEvent, states.DonationCancelledEvent), 1),
+)
+
+
+class Dataset(typing.NamedTuple):
+    organizations: typing.List[models.Organization]
+    donators: typing.List[models.Donator]
+    required_items: typing.List[models.RequiredItem]
+    donations: typing.List[models.Donation]
+
+
+def create_users(prefix: str, count: int, password: str) -> typing.List[User]:
+    return User.objects.bulk_create(
+        User(
+            username=f"{prefix}{i}",
+            email=f"{prefix}{i}@example.com",
+            password=password,
+        )
+        for i in range(count)
+    )
+
+
+@transaction.atomic
+def seed(
+    organizations: int = 20,
+    donators: int = 20,
+    required_items: int = 200,
+    donations: int = 1000,
+    random_seed: int = 0,
+    prefix: str = "seed",
+) -> Dataset:
+    """Create the organizations across all the cities, their required items
+    and the donations with their event histories
+
+    The users are named `{prefix}-org-{i}` and `{prefix}-donator-{i}`, their
+    password is `PASSWORD`.
+    """
+    rng = random.Random(random_seed)
+    today = date.today()
+    password = make_password(PASSWORD)  # Hashed once for all the users
+
+    cities = list(choices.Cities)
+    org_users = create_users(f"{prefix}-org-", organizations, password)
+    orgs = models.Organization.objects.bulk_create(
+        models.Organization(
+            user=user,
+            name=f"organization {i}",
+            type=rng.choice(choices.OrganizationTypes.values),
+            city=cities[i % len(cities)],
+            address=f"address {i}",
+            phone="0212345678",
+            other_contact_method=choices.ContactMethods.not_set,
+        )
+        for i, user in enumerate(org_users)
+    )
+
+    donator_users = create_users(f"{prefix}-donator-", donators, password)
+    donator_objs = models.Donator.objects.bulk_create(
+        models.Donator(
+            user=user,
+            phone="0912345678",
+            other_contact_method=rng.choice(choices.ContactMethods.values),
+            other_contact=f"contact {i}",
+        )
+        for i, user in enumerate(donator_users)
+    )
+
+    items = []
+    for i in range(required_items):
+        ended_date = today + timedelta(days=rng.randint(-30, 60))
+        items.append(
+            models.RequiredItem(
+                organization=rng.choice(orgs),
+                name=f"item {i}",
+                amount=rng.randint(10, 1000),
+                unit=rng.choice(choices.Units.values),
+                ended_date=ended_date,
+                # The over-due ones as left by `RequiredItem.expire_overdue`
+                state=(
+                    states.CollectingState.state_id()
+                    if ended_date >= today
+                    else states.CancelledState.state_id()
+                ),
+            )
+        )
+    items = models.RequiredItem.objects.bulk_create(items)
+
+    histories, weights = zip(*HISTORIES)
+    donation_objs = []
+    events = []
+    now = timezone.now()
+    for _ in range(donations):
+        item = rng.choice(items)
+        donator = rng.choice(donator_users)
+        history = [] if not item.is_valid() else rng.choices(histories, weights)[0]
+        donation = models.Donation(
+            required_item=item,
+            amount=rng.randint(1, max(item.amount // 10, 1)),
+            created_by=donator,
+            state=states.replay(event.event_id() for event in history),
+        )
+        donation_objs.append(donation)
+        for hours, event_cls in enumerate(history, 1):
+            events.append(
+                models.DonationEvent(
+                    donation=donation,
+                    name=event_cls.event_id(),
+                    # The donators dispatch or cancel, the organizations do
+                    # the rest.
+                    created_by=(
+                        donator
+                        if issubclass(event_cls, states.donator_events)
+                        else item.organization.user
+                    ),
+                    created_at=now - timedelta(hours=len(history) - hours),
+                )
+            )
+    donation_objs = models.Donation.objects.bulk_create(donation_objs)
+    for event in events:
+        event.donation_id = event.donation.id
+    models.DonationEvent.objects.bulk_create(events)
+
+    models.RequiredItem.refresh_amounts(
+        models.RequiredItem.objects.filter(id__in=[item.id for item in items])
+    )
+    response_cache.bump_data_version_on_commit()
+    return Dataset(orgs, donator_objs, items, donation_objs)
@@ -162,3 +162,29 @@ def get_state(name: str):
     if name in donation_states:
         return donation_states[name]()
     raise ValueError(f"Unknown state: {name}")
+
+
+def _compile_transitions() -> typing.Dict[typing.Tuple[str, str], str]:
+    return {
+        (state_id, event_id): state_cls().apply(event_cls()).state_id()
+        for state_id, state_cls in donation_states.items()
+        for event_id, event_cls in events.items()
+    }
+
+
+# (state, event) -> next state of the donations, compiled from `State.apply`
+transitions = _compile_transitions()
+
+
+def transition(state: str, event: str) -> str:
+    """Return the next state of the donation, an unknown pair is invalid"""
+    return transitions.get((state, event), InvalidState.state_id())
+
+
+def replay(
+    event_names: typing.Iterable[str], state: str = PendingApprovalState.state_id()
+) -> str:
+    """Replay the whole history of a donation, see `transition`"""
+    for event in event_names:
+        state = transition(state, event)
+    return state
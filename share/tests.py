@@ -1,6 +1,20 @@
+import re
+import typing
 import unittest
+from datetime import date, timedelta
 
-from . import states
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from authenticator.api import Authenticator
+
+from . import api, choices, models, pagination, response_cache, seed, states
+
+User = get_user_model()
 
 
 class DonationStateTestCase(unittest.TestCase):
@@ -54,3 +68,617 @@ class DonationStateTestCase(unittest.TestCase):
         self.assertIsInstance(
             collect_pending_state.apply(cancelled_event), states.InvalidState
         )
+
+
+class TransitionTableTestCase(unittest.TestCase):
+    def test_same_as_states(self):
+        for state_id, state_cls in states.donation_states.items():
+            for event_id, event_cls in states.events.items():
+                self.assertEqual(
+                    states.transition(state_id, event_id),
+                    state_cls().apply(event_cls()).state_id(),
+                )
+
+    def test_replay(self):
+        self.assertEqual(
+            states.replay(
+                [
+                    states.DonationApprovedEvent.event_id(),
+                    states.DonationDispatchedEvent.event_id(),
+                ]
+            ),
+            states.DoneState.state_id(),
+        )
+        self.assertEqual(
+            states.replay(["UnknownEvent"]), states.InvalidState.state_id()
+        )
+
+
+def create_organization(username: str, **kwargs) -> models.Organization:
+    user = User.objects.create_user(username=username, password="password")
+    kwargs.setdefault("type", choices.OrganizationTypes.hospital)
+    kwargs.setdefault("city", choices.Cities.TPE)
+    return models.Organization.objects.create(name=username, user=user, **kwargs)
+
+
+def create_donator(username: str) -> User:
+    user = User.objects.create_user(username=username, password="password")
+    models.Donator.objects.create(user=user)
+    return user
+
+
+def access_token(user) -> str:
+    return Authenticator().login(user)[0]
+
+
+def create_required_item(organization, **kwargs) -> models.RequiredItem:
+    kwargs.setdefault("name", "mask")
+    kwargs.setdefault("amount", 100)
+    kwargs.setdefault("unit", choices.Units.piece)
+    kwargs.setdefault("ended_date", date.today() + timedelta(days=7))
+    return models.RequiredItem.objects.create(organization=organization, **kwargs)
+
+
+class RequiredItemAmountTestCase(TestCase):
+    def setUp(self):
+        self.organization = create_organization("org")
+        self.org_user = self.organization.user
+        self.donator_user = create_donator("donator")
+        self.required_item = create_required_item(self.organization)
+
+    def create_donation(self, amount: int) -> models.Donation:
+        return models.Donation.objects.create(
+            required_item=self.required_item,
+            amount=amount,
+            created_by=self.donator_user,
+        )
+
+    def set_event(self, donation, user, event):
+        donation.set_event(user, {"name": event.event_id()})
+
+    def test_amounts_follow_donation_states(self):
+        d1 = self.create_donation(10)
+        d2 = self.create_donation(20)
+        self.set_event(d1, self.org_user, states.DonationApprovedEvent)
+        self.set_event(d2, self.org_user, states.DonationApprovedEvent)
+
+        self.required_item.refresh_from_db()
+        self.assertEqual(self.required_item.approved_amount, 30)
+        self.assertEqual(self.required_item.delivered_amount, 0)
+
+        self.set_event(d1, self.donator_user, states.DonationDispatchedEvent)
+        self.set_event(d2, self.donator_user, states.DonationCancelledEvent)
+
+        self.required_item.refresh_from_db()
+        self.assertEqual(self.required_item.approved_amount, 10)
+        self.assertEqual(self.required_item.delivered_amount, 10)
+
+    def test_events_are_recorded(self):
+        donation = self.create_donation(10)
+        self.set_event(donation, self.org_user, states.DonationApprovedEvent)
+        self.set_event(donation, self.donator_user, states.DonationDispatchedEvent)
+
+        events = list(donation.events.values_list("name", "created_by"))
+        self.assertEqual(
+            events,
+            [
+                (states.DonationApprovedEvent.event_id(), self.org_user.id),
+                (states.DonationDispatchedEvent.event_id(), self.donator_user.id),
+            ],
+        )
+        self.assertIsInstance(donation.calc_state(), states.DoneState)
+
+        approvals = models.DonationEvent.objects.filter(
+            name=states.DonationApprovedEvent.event_id(),
+            created_at__gte=timezone.now() - timedelta(hours=1),
+        )
+        self.assertEqual(approvals.count(), 1)
+
+    def test_refresh_amounts(self):
+        d1 = self.create_donation(10)
+        self.set_event(d1, self.org_user, states.DonationApprovedEvent)
+        models.RequiredItem.objects.update(approved_amount=0, delivered_amount=5)
+
+        self.assertEqual(models.RequiredItem.refresh_amounts(), 1)
+        self.assertEqual(models.RequiredItem.refresh_amounts(), 0)
+
+        self.required_item.refresh_from_db()
+        self.assertEqual(self.required_item.approved_amount, 10)
+        self.assertEqual(self.required_item.delivered_amount, 0)
+
+    def test_refresh_amounts_invalidates_responses(self):
+        d1 = self.create_donation(10)
+        self.set_event(d1, self.org_user, states.DonationApprovedEvent)
+        models.RequiredItem.objects.update(approved_amount=0)
+
+        version = response_cache.get_data_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            models.RequiredItem.refresh_amounts()
+        self.assertNotEqual(response_cache.get_data_version(), version)
+
+    def test_amounts_follow_saved_and_deleted_donations(self):
+        d1 = self.create_donation(10)
+        d2 = self.create_donation(20)
+        self.set_event(d1, self.org_user, states.DonationApprovedEvent)
+        self.set_event(d2, self.org_user, states.DonationApprovedEvent)
+        self.set_event(d2, self.donator_user, states.DonationDispatchedEvent)
+
+        # Like the admin, which saves and deletes the donations one by one
+        donation = models.Donation.objects.get(id=d1.id)
+        donation.amount = 15
+        donation.save()
+        self.required_item.refresh_from_db()
+        self.assertEqual(self.required_item.approved_amount, 35)
+        self.assertEqual(self.required_item.delivered_amount, 20)
+
+        models.Donation.objects.get(id=d2.id).delete()
+        self.required_item.refresh_from_db()
+        self.assertEqual(self.required_item.approved_amount, 15)
+        self.assertEqual(self.required_item.delivered_amount, 0)
+
+        models.Donation.objects.filter(id=d1.id).delete()
+        self.required_item.refresh_from_db()
+        self.assertEqual(self.required_item.approved_amount, 0)
+        self.assertEqual(models.RequiredItem.refresh_amounts(), 0)
+
+
+class ListRequiredItemsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.donator_user = create_donator("donator")
+        self.seeded = 0
+
+    def seed(self, n_organizations: int, n_items: int):
+        for i in range(n_organizations):
+            organization = create_organization(f"org{self.seeded + i}")
+            for _ in range(n_items):
+                item = create_required_item(organization)
+                models.Donation.objects.create(
+                    required_item=item, amount=1, created_by=self.donator_user
+                )
+        self.seeded += n_organizations
+
+    def test_grouped_by_organization(self):
+        self.seed(2, 3)
+        create_required_item(
+            models.Organization.objects.first(),
+            ended_date=date.today() - timedelta(days=1),
+        )
+
+        resp = self.client.get("/required-items")
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()["results"]
+        self.assertEqual(len(data), 2)
+        for group in data:
+            self.assertEqual(len(group["items"]), 3)
+            self.assertEqual(len(group["items"][0]["donations"]), 1)
+
+    def test_query_count_does_not_grow(self):
+        self.seed(2, 2)
+        with self.assertNumQueries(2):
+            self.client.get("/required-items")
+
+        self.seed(10, 5)
+        with self.assertNumQueries(2):
+            self.client.get("/required-items")
+
+    def test_cached_until_data_changed(self):
+        self.seed(1, 2)
+        resp = self.client.get("/required-items")
+        etag = resp["ETag"]
+
+        with self.assertNumQueries(0):
+            resp = self.client.get("/required-items")
+        self.assertEqual(resp["ETag"], etag)
+
+        with self.assertNumQueries(0):
+            resp = self.client.get("/required-items", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+        self.seed(1, 1)
+        resp = self.client.get("/required-items", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp["ETag"], etag)
+        self.assertEqual(len(resp.json()["results"]), 2)
+
+    def test_cached_until_organization_changed(self):
+        self.seed(1, 1)
+        resp = self.client.get("/required-items")
+        etag = resp["ETag"]
+
+        organization = models.Organization.objects.get()
+        organization.name = "renamed"
+        organization.save()
+        resp = self.client.get("/required-items", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp["ETag"], etag)
+        self.assertIn("renamed", resp.content.decode())
+
+    def test_paginated_by_cursor(self):
+        self.seed(3, 3)
+
+        resp = self.client.get("/required-items", {"page_size": 4}).json()
+        self.assertIsNone(resp["previous"])
+        self.assertEqual([len(g["items"]) for g in resp["results"]], [3, 1])
+
+        resp = self.client.get(resp["next"]).json()
+        self.assertIsNotNone(resp["previous"])
+        self.assertEqual([len(g["items"]) for g in resp["results"]], [2, 2])
+
+        resp = self.client.get(resp["next"]).json()
+        self.assertIsNone(resp["next"])
+        self.assertEqual([len(g["items"]) for g in resp["results"]], [1])
+
+        resp = self.client.get(resp["previous"]).json()
+        self.assertEqual([len(g["items"]) for g in resp["results"]], [2, 2])
+
+    def test_page_uses_index(self):
+        self.seed(2, 2)
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get("/required-items")
+        (sql,) = [
+            query["sql"]
+            for query in captured.captured_queries
+            if query["sql"].startswith('SELECT "share_requireditem"."id"')
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(f"EXPLAIN {sql}")
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        # The keys of the ordering follow the index, no sort is needed
+        self.assertIn("Index Scan Backward", plan)
+        self.assertNotIn("Sort", plan)
+
+
+class FilterRequiredItemsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        tpe = create_organization("tpe", city=choices.Cities.TPE)
+        khh = create_organization(
+            "khh", city=choices.Cities.KHH, type=choices.OrganizationTypes.other
+        )
+        create_required_item(tpe, unit=choices.Units.piece)
+        create_required_item(tpe, unit=choices.Units.set)
+        create_required_item(
+            khh, unit=choices.Units.set, state=states.CancelledState.state_id()
+        )
+
+    def count_items(self, **params) -> int:
+        resp = self.client.get("/required-items", params)
+        self.assertEqual(resp.status_code, 200)
+        return sum(len(g["items"]) for g in resp.json()["results"])
+
+    def test_filters(self):
+        self.assertEqual(self.count_items(), 3)
+        self.assertEqual(self.count_items(city="TPE"), 2)
+        self.assertEqual(self.count_items(organization_type="other"), 1)
+        self.assertEqual(self.count_items(unit="set"), 2)
+        self.assertEqual(self.count_items(collecting=True), 2)
+        self.assertEqual(self.count_items(collecting=False, city="KHH"), 1)
+        self.assertEqual(self.count_items(unit="set", collecting=True), 1)
+
+        resp = self.client.get("/required-items", {"city": "unknown"})
+        self.assertEqual(resp.status_code, 422)
+
+    def explain(self, **filters) -> str:
+        queryset = api.filter_required_items(
+            models.RequiredItem.objects.filter(ended_date__gte=date.today()),
+            **filters,
+        )
+        with connection.cursor() as cursor:
+            # The tables are too small to prefer the indexes otherwise
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        return queryset.explain()
+
+    def test_filters_use_indexes(self):
+        plan = self.explain(city="TPE", organization_type="hospital")
+        self.assertIn("share_org_city_type_idx", plan)
+
+        plan = self.explain(unit="set", collecting=True)
+        self.assertIn("share_item_state_unit_idx", plan)
+
+
+class CreateDonationTestCase(TestCase):
+    def setUp(self):
+        self.donator_user = create_donator("donator")
+        self.headers = {
+            "HTTP_AUTHORIZATION": f"Bearer {access_token(self.donator_user)}"
+        }
+        organization = create_organization("org")
+        self.items = [create_required_item(organization) for _ in range(10)]
+
+    def post(self, payload):
+        resp = self.client.post(
+            "/required-items/donations",
+            payload,
+            content_type="application/json",
+            **self.headers,
+        )
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    def test_result_per_row(self):
+        cancelled = create_required_item(
+            self.items[0].organization, state=states.CancelledState.state_id()
+        )
+        result = self.post(
+            [
+                {"id": self.items[0].id, "amount": 1},
+                {"id": 0, "amount": 1},
+                {"id": cancelled.id, "amount": 1},
+                {"id": self.items[0].id, "amount": 1000},
+                {"id": self.items[0].id, "amount": 2},
+            ]
+        )
+        self.assertEqual(result[0]["donation"]["amount"], 1)
+        self.assertIn("doesn't exist", result[1]["message"])
+        self.assertIn("no longer collecting", result[2]["message"])
+        self.assertIn("greater than", result[3]["message"])
+        self.assertEqual(result[4]["donation"]["amount"], 2)
+        self.assertEqual(
+            models.Donation.objects.filter(required_item=self.items[0]).count(), 2
+        )
+
+    def test_query_count_does_not_grow_with_rows(self):
+        def payload(repeat):
+            return [{"id": item.id, "amount": 1} for item in self.items[:2]] * repeat
+
+        self.post([])  # cache the user
+        with CaptureQueriesContext(connection) as small:
+            self.post(payload(1))
+        with CaptureQueriesContext(connection) as large:
+            self.post(payload(25))
+        self.assertEqual(len(small), len(large))
+
+
+class EditDonationTestCase(TestCase):
+    def setUp(self):
+        self.organization = create_organization("org")
+        self.donator_user = create_donator("donator")
+        self.headers = {
+            "HTTP_AUTHORIZATION": f"Bearer {access_token(self.donator_user)}"
+        }
+        self.required_item = create_required_item(self.organization)
+
+    def create_donations(self, n: int) -> typing.List[models.Donation]:
+        donations = [
+            models.Donation(
+                required_item=self.required_item,
+                amount=1,
+                created_by=self.donator_user,
+                state=states.PendingDispatchState.state_id(),
+            )
+            for _ in range(n)
+        ]
+        models.Donation.create_in_bulk(donations)
+        models.RequiredItem.refresh_amounts()
+        return donations
+
+    def patch(self, payload):
+        resp = self.client.patch(
+            "/donations", payload, content_type="application/json", **self.headers
+        )
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    def test_result_per_row(self):
+        d1, d2 = self.create_donations(2)
+        result = self.patch(
+            [
+                {"id": d1.id, "event": states.DonationDispatchedEvent.event_id()},
+                {"id": 0, "event": states.DonationDispatchedEvent.event_id()},
+                {"id": d2.id, "event": states.DonationApprovedEvent.event_id()},
+                {"id": d1.id, "event": states.DonationCancelledEvent.event_id()},
+                {"id": d2.id, "event": states.DonationCancelledEvent.event_id()},
+            ]
+        )
+        self.assertEqual(result[0]["donation"]["state"], states.DoneState.state_id())
+        self.assertIn("doesn't exist", result[1]["message"])
+        self.assertIn("Invalid event of the donator", result[2]["message"])
+        self.assertIn("invalid state", result[3]["message"])
+        self.assertEqual(
+            result[4]["donation"]["state"], states.CancelledState.state_id()
+        )
+
+        self.required_item.refresh_from_db()
+        self.assertEqual(self.required_item.approved_amount, 1)
+        self.assertEqual(self.required_item.delivered_amount, 1)
+
+    def test_query_count_does_not_grow(self):
+        def dispatch(donations):
+            return [
+                {"id": d.id, "event": states.DonationDispatchedEvent.event_id()}
+                for d in donations
+            ]
+
+        donations = self.create_donations(30)
+        self.patch([])  # cache the user
+        with CaptureQueriesContext(connection) as small:
+            self.patch(dispatch(donations[:2]))
+        with CaptureQueriesContext(connection) as large:
+            self.patch(dispatch(donations[2:]))
+        self.assertEqual(len(small), len(large))
+
+    def test_lock_order(self):
+        # Like `RequiredItem.expire_overdue`, the required items are locked
+        # and updated in the order of their IDs before the donations.
+        (d1,) = self.create_donations(1)
+        self.required_item = create_required_item(self.organization)
+        (d2,) = self.create_donations(1)
+        self.patch([])  # cache the user
+        with CaptureQueriesContext(connection) as captured:
+            self.patch(
+                [
+                    {"id": d.id, "event": states.DonationDispatchedEvent.event_id()}
+                    for d in (d2, d1)
+                ]
+            )
+
+        statements = [query["sql"] for query in captured.captured_queries]
+        locks = [
+            i
+            for i, sql in enumerate(statements)
+            if "FOR UPDATE OF" in sql and 'FROM "share_requireditem"' in sql
+        ]
+        donation_locks = [
+            i
+            for i, sql in enumerate(statements)
+            if "FOR UPDATE OF" in sql and 'FROM "share_donation"' in sql
+        ]
+        self.assertLess(locks[0], donation_locks[0])
+        updated = [
+            int(re.search(r'"id" = (\d+)', sql).group(1))
+            for sql in statements
+            if sql.startswith('UPDATE "share_requireditem"')
+            and '"approved_amount" +' in sql
+        ]
+        self.assertEqual(updated, [d1.required_item_id, d2.required_item_id])
+
+    def test_cancel_required_item(self):
+        donations = self.create_donations(3)
+        self.required_item.cancel(self.organization.user, "User cancelled.")
+
+        self.required_item.refresh_from_db()
+        self.assertEqual(self.required_item.state, states.CancelledState.state_id())
+        self.assertEqual(self.required_item.approved_amount, 0)
+        for donation in donations:
+            donation.refresh_from_db()
+            self.assertEqual(donation.state, states.CancelledState.state_id())
+
+
+class ExpireOverdueTestCase(TestCase):
+    def test_expire_overdue(self):
+        organization = create_organization("org")
+        donator_user = create_donator("donator")
+        overdue = create_required_item(
+            organization, ended_date=date.today() - timedelta(days=1)
+        )
+        collecting = create_required_item(organization)
+        donations = {}
+        for state in (
+            states.PendingApprovalState,
+            states.PendingDispatchState,
+            states.DoneState,
+        ):
+            donations[state] = models.Donation(
+                required_item=overdue,
+                amount=1,
+                created_by=donator_user,
+                state=state.state_id(),
+            )
+        models.Donation.objects.bulk_create(donations.values())
+        models.RequiredItem.refresh_amounts()
+
+        self.assertEqual(models.RequiredItem.expire_overdue(chunk_size=1), 1)
+        self.assertEqual(models.RequiredItem.expire_overdue(), 0)
+
+        overdue.refresh_from_db()
+        self.assertEqual(overdue.state, states.CancelledState.state_id())
+        self.assertEqual(overdue.approved_amount, 1)
+        self.assertEqual(overdue.delivered_amount, 1)
+        collecting.refresh_from_db()
+        self.assertEqual(collecting.state, states.CollectingState.state_id())
+
+        for state, donation in donations.items():
+            donation.refresh_from_db()
+            if state is states.DoneState:
+                self.assertEqual(donation.state, state.state_id())
+            else:
+                self.assertEqual(donation.state, states.CancelledState.state_id())
+                event = donation.events.last()
+                self.assertEqual(event.comment, "Over-due")
+                self.assertIsNone(event.created_by)
+
+
+class PrincipalCacheTestCase(TestCase):
+    def setUp(self):
+        self.organization = create_organization("org")
+        self.headers = {
+            "HTTP_AUTHORIZATION": f"Bearer {access_token(self.organization.user)}"
+        }
+
+    def get_me(self):
+        resp = self.client.get("/users/me", **self.headers)
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    def test_no_auth_queries_once_cached(self):
+        self.get_me()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_me()["name"], "org")
+
+    def test_invalidated_by_saves(self):
+        self.get_me()
+        self.organization.name = "new name"
+        self.organization.save()
+        self.assertEqual(self.get_me()["name"], "new name")
+
+        user = self.organization.user
+        user.email = "org@example.com"
+        user.save()
+        self.assertEqual(self.get_me()["email"], "org@example.com")
+
+        user.is_active = False
+        user.save()
+        resp = self.client.get("/users/me", **self.headers)
+        self.assertEqual(resp.status_code, 403)
+
+
+class DonationPaginationTestCase(TestCase):
+    def setUp(self):
+        self.donator_user = create_donator("donator")
+        required_item = create_required_item(create_organization("org"))
+        self.donation_ids = [
+            models.Donation.objects.create(
+                required_item=required_item, amount=1, created_by=self.donator_user
+            ).id
+            for _ in range(5)
+        ]
+        self.donation_ids.reverse()
+        self.headers = {
+            "HTTP_AUTHORIZATION": f"Bearer {access_token(self.donator_user)}"
+        }
+
+    def get_ids(self, url, **kwargs):
+        resp = self.client.get(url, kwargs, **self.headers)
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        return [d["id"] for d in data["results"]], data["next"], data["previous"]
+
+    def test_walk_forward_and_backward(self):
+        ids, next_url, previous_url = self.get_ids("/donations", page_size=2)
+        self.assertEqual(ids, self.donation_ids[:2])
+        self.assertIsNone(previous_url)
+
+        ids, next_url, previous_url = self.get_ids(next_url)
+        self.assertEqual(ids, self.donation_ids[2:4])
+
+        ids, next_url, _ = self.get_ids(next_url)
+        self.assertEqual(ids, self.donation_ids[4:])
+        self.assertIsNone(next_url)
+
+        ids, next_url, previous_url = self.get_ids(previous_url)
+        self.assertEqual(ids, self.donation_ids[:2])
+        self.assertIsNone(previous_url)
+        self.assertIsNotNone(next_url)
+
+    def test_invalid_cursor(self):
+        resp = self.client.get("/donations", {"cursor": "!"}, **self.headers)
+        self.assertEqual(resp.status_code, 400)
+        for values in (["2021-06-01T00:00:00+00:00", "x"], [None, None], [[], {}]):
+            cursor = pagination.encode_cursor(values, False)
+            resp = self.client.get("/donations", {"cursor": cursor}, **self.headers)
+            self.assertEqual(resp.status_code, 400, values)
+
+
+class SeedTestCase(TestCase):
+    def test_states(self):
+        seed.seed(organizations=2, donators=2, required_items=20, donations=200)
+        self.assertFalse(
+            models.Donation.objects.filter(
+                state=states.InvalidState.state_id()
+            ).exists()
+        )
+        # The seeded states are the ones of the events
+        for donation in models.Donation.objects.all():
+            self.assertEqual(donation.state, donation.calc_state().state_id())